@@ -1,11 +1,17 @@
-from models.models import Voluum
+from models.models import Voluum, run_tables
 
 
 def main(request):
     data = request.get_json()
     print(data)
 
-    if "table" in data:
+    if "table" in data and (isinstance(data["table"], list) or data["table"] == "all"):
+        response = run_tables(
+            data["table"],
+            data.get("start"),
+            data.get("end"),
+        )
+    elif "table" in data:
         response = Voluum.factory(
             data["table"],
             data.get("start"),
@@ -15,4 +21,6 @@ def main(request):
         raise ValueError(data)
 
     print(response)
+    if response.get("failed"):
+        return response, 500
     return response
@@ -1,59 +1,63 @@
-from models.models import Voluum, BASE_URL
+from models.models import Voluum, Field
+from models.settings import BASE_URL
+from models.api import get_json
+from models.checkpoints import get_watermark, set_watermark
+from models.timestamps import to_datetime
 
 
 class Offer(Voluum):
     keys = {
-        "p_key": ["id",
+        "p_key": [
+            "id",
         ],
         "incre_key": "updatedTime",
+        "partition_key": "createdTime",
+        "cluster_key": ["id"],
     }
-    schema = [
-        {"name": "id", "type": "STRING"},
-        {"name": "name", "type": "STRING"},
-        {"name": "namePostfix", "type": "STRING"},
-        {"name": "createdTime", "type": "TIMESTAMP"},
-        {"name": "updatedTime", "type": "TIMESTAMP"},
-        {"name": "deleted", "type": "BOOLEAN"},
-        {"name": "url", "type": "STRING"},
-        {"name": "currencyCode", "type": "STRING"},
+    fields = [
+        Field("id", "STRING"),
+        Field("name", "STRING"),
+        Field("namePostfix", "STRING"),
+        Field("createdTime", "TIMESTAMP"),
+        Field("updatedTime", "TIMESTAMP"),
+        Field("deleted", "BOOLEAN"),
+        Field("url", "STRING"),
+        Field("currencyCode", "STRING"),
     ]
 
+    incremental = True
+
     def __init__(self, *args):
         super().__init__()
+        self.watermark = None
+        self.updated_at = None
+        if self.incremental:
+            self.watermark = get_watermark(self.table, self.keys)
 
-    def _get(self, session, headers):
-        with session.get(
-            url=f"{BASE_URL}/offer",
-            params={
-                "includeDeleted": True,
-                "fields": [
-                    "createdTime",
-                    "currencyCode",
-                    "deleted",
-                    "id",
-                    "name",
-                    "namePostfix",
-                    "updatedTime",
-                    "url",
-                ],
-            },
-            headers=headers,
-        ) as r:
-            r.raise_for_status()
-            res = r.json()
-        return res["offers"]
+    def _checkpoint(self):
+        super()._checkpoint()
+        if self.updated_at:
+            set_watermark(self.table, self.updated_at)
 
-    def _transform(self, rows):
-        return [
+    def _get(self, session):
+        res = get_json(
+            session,
+            f"{BASE_URL}/offer",
             {
-                "createdTime": row["createdTime"],
-                "currencyCode": row["currencyCode"],
-                "deleted": row["deleted"],
-                "id": row["id"],
-                "name": row["name"],
-                "namePostfix": row["namePostfix"],
-                "updatedTime": row["updatedTime"],
-                "url": row["url"],
-            }
-            for row in rows
+                "includeDeleted": True,
+                "fields": self.columns,
+            },
+        )
+        offers = res["offers"]
+        updated = [
+            to_datetime(offer["updatedTime"]) if offer.get("updatedTime") else None
+            for offer in offers
         ]
+        self.updated_at = max([i for i in updated if i], default=None)
+        if self.watermark:
+            offers = [
+                offer
+                for offer, updated_at in zip(offers, updated)
+                if not updated_at or updated_at >= self.watermark
+            ]
+        return [({}, offers)]
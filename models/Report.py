@@ -1,42 +1,80 @@
-import time
 from datetime import datetime, timedelta
 
 import pytz
 
-from models.models import Voluum, BASE_URL, NOW, DATE_FORMAT, TZ
+from models.models import WindowedVoluum, Field, Rollup
+from models.settings import BASE_URL, NOW, DATE_FORMAT, TZ
+from models.api import paginate
+from models.cache import CACHE_SETTLED_DAYS, RESPONSE_CACHE, cache_key
 
 
-class Report(Voluum):
+class Report(WindowedVoluum):
     keys = {
         "p_key": [
             "date_start",
             "campaignId",
         ],
         "incre_key": "_batched_at",
+        "partition_key": "date_start",
+        "cluster_key": ["campaignId"],
     }
-    schema = [
-        {"name": "campaignId", "description": "Campaign ID", "type": "STRING"},
-        {"name": "campaignName", "description": "Campaign", "type": "STRING"},
-        {"name": "clicks", "description": "Clicks", "type": "INTEGER"},
-        {"name": "conversions", "description": "Conversions", "type": "INTEGER"},
-        {"name": "cost", "description": "Cost", "type": "FLOAT"},
-        {"name": "customConversions1", "description": "LEAD", "type": "INTEGER"},
-        {"name": "customConversions5", "description": "VIEW", "type": "INTEGER"},
-        {"name": "deleted", "description": "Deleted", "type": "BOOLEAN"},
-        {"name": "hour", "description": "Hour", "type": "INTEGER"},
-        {"name": "impressions", "description": "Impressions", "type": "INTEGER"},
-        {"name": "profit", "description": "Profit", "type": "FLOAT"},
-        {"name": "revenue", "description": "Revenue", "type": "FLOAT"},
-        {"name": "uniqueVisits", "description": "Unique visits", "type": "INTEGER"},
-        {"name": "visits", "description": "Visits", "type": "INTEGER"},
-        {"name": "date_start", "type": "TIMESTAMP"},
-        {"name": "date_end", "type": "TIMESTAMP"},
-        {"name": "_batched_at", "type": "TIMESTAMP"},
+    load_format = "parquet"
+    dedup = True
+    fields = [
+        Field("campaignId", "STRING", "Campaign ID"),
+        Field("campaignName", "STRING", "Campaign"),
+        Field("clicks", "INTEGER", "Clicks"),
+        Field("conversions", "INTEGER", "Conversions"),
+        Field("cost", "FLOAT", "Cost"),
+        Field("customConversions1", "INTEGER", "LEAD"),
+        Field("customConversions5", "INTEGER", "VIEW"),
+        Field("deleted", "BOOLEAN", "Deleted"),
+        Field("hour", "INTEGER", "Hour"),
+        Field("impressions", "INTEGER", "Impressions"),
+        Field("profit", "FLOAT", "Profit"),
+        Field("revenue", "FLOAT", "Revenue"),
+        Field("uniqueVisits", "INTEGER", "Unique visits"),
+        Field("visits", "INTEGER", "Visits"),
+        Field("date_start", "TIMESTAMP", column=None),
+        Field("date_end", "TIMESTAMP", column=None),
+        Field("_batched_at", "TIMESTAMP", column=None),
+    ]
+    rollups = [
+        Rollup(
+            "weekly",
+            "WEEK(MONDAY)",
+            ["campaignId"],
+            {
+                "campaignName": "ANY_VALUE(campaignName)",
+                "impressions": "SUM(impressions)",
+                "visits": "SUM(visits)",
+                "uniqueVisits": "SUM(uniqueVisits)",
+                "clicks": "SUM(clicks)",
+                "conversions": "SUM(conversions)",
+                "customConversions1": "SUM(customConversions1)",
+                "customConversions5": "SUM(customConversions5)",
+                "revenue": "SUM(revenue)",
+                "cost": "SUM(cost)",
+                "profit": "SUM(profit)",
+            },
+        ),
+    ]
+    columns = [
+        "day",
+        "campaignName",
+        "campaignId",
+        "impressions",
+        "visits",
+        "uniqueVisits",
+        "clicks",
+        "conversions",
+        "customConversions1",
+        "customConversions5",
+        "revenue",
+        "cost",
+        "profit",
+        "deleted",
     ]
-
-    def __init__(self, start, end):
-        super().__init__()
-        self.start, self.end = self._get_time_range(start, end)
 
     def _get_time_range(self, _start, _end):
         if _start and _end:
@@ -47,72 +85,39 @@ class Report(Voluum):
             start = NOW - timedelta(days=28)
         return start, end
 
-    def _get(self, session, headers):
+    def _get_windows(self, session, start):
         date_ranges = [
-            self.start + timedelta(i)
-            for i in range(int((self.end - self.start).days) + 1)
+            start + timedelta(i) for i in range(int((self.end - start).days) + 1)
         ]
         date_ranges = [date.replace(hour=0, minute=0, second=0) for date in date_ranges]
-        return [self._get_one(session, headers, date) for date in date_ranges]
+        return [(date, date + timedelta(days=1)) for date in date_ranges]
 
-    def _get_one(self, session, headers, date, offset=0):
-        limit = 10000
-        with session.get(
-            f"{BASE_URL}/report",
-            params={
-                "include": "ALL",
-                "from": date.isoformat(timespec="seconds") + "Z",
-                "to": (date + timedelta(days=1)).isoformat(timespec="seconds") + "Z",
-                "tz": TZ,
-                "column": [
-                    "day",
-                    "campaignName",
-                    "campaignId",
-                    "impressions",
-                    "visits",
-                    "uniqueVisits",
-                    "clicks",
-                    "conversions",
-                    "customConversions1",
-                    "customConversions5",
-                    "revenue",
-                    "cost",
-                    "profit",
-                    "deleted",
-                ],
-                "conversionTimeMode": "VISIT",
-                "groupBy": "campaign",
-                "limit": limit,
-                "offset": offset,
-            },
-            headers=headers,
-        ) as r:
-            r.raise_for_status()
-            res = r.json()
-        rows = res["rows"]
-        rows = [
-            {
-                **row,
-                "date_start": pytz.timezone(TZ)
-                .localize(date)
-                .isoformat(timespec="seconds"),
-                "date_end": (
-                    pytz.timezone(TZ).localize(date) + timedelta(days=1)
-                ).isoformat(timespec="seconds"),
-            }
-            for row in rows
-        ]
-        time.sleep(1)
+    def _get_window(self, session, window):
+        date, _ = window
+        date_start = pytz.timezone(TZ).localize(date)
+        date_end = date_start + timedelta(days=1)
+        params = {
+            "include": "ALL",
+            "from": date.isoformat(timespec="seconds") + "Z",
+            "to": (date + timedelta(days=1)).isoformat(timespec="seconds") + "Z",
+            "tz": TZ,
+            "column": self.columns,
+            "conversionTimeMode": "VISIT",
+            "groupBy": "campaign",
+        }
+        settled_at = pytz.utc.localize(NOW) - timedelta(days=CACHE_SETTLED_DAYS)
+        settled = date_end <= settled_at
+        key = cache_key({**params, "column": sorted(self.columns)})
+        rows = RESPONSE_CACHE.get(key) if settled else None
+        if rows is None:
+            pages = paginate(session, f"{BASE_URL}/report", params)
+            rows = [row for rows in pages for row in rows]
+            if settled:
+                RESPONSE_CACHE.set(key, rows)
         return (
-            rows + self._get_one(session, headers, date, offset + limit) if rows else []
-        )
-
-    def _transform(self, rows):
-        rows = [i for j in rows for i in j]
-        return [
             {
-                **row,
-                "_batched_at": NOW.isoformat(),
-            }
-            for row in rows
-        ]
+                "date_start": date_start.isoformat(timespec="seconds"),
+                "date_end": date_end.isoformat(timespec="seconds"),
+            },
+            rows,
+        )
@@ -1,11 +1,18 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import pytz
 
-from models.models import Voluum, BQ_CLIENT, DATASET, BASE_URL, NOW, DATE_FORMAT, TZ
+from models.models import WindowedVoluum, Field, Rollup, get_windows, fetch_window
+from models.settings import BASE_URL, NOW, DATE_FORMAT, TZ, INITIAL_LOOKBACK
+from models.checkpoints import get_watermark, set_watermark
+from models.timestamps import parse_timestamp
 
 
-class ReportConversions(Voluum):
+def to_timestamp(x):
+    return parse_timestamp(x, TZ)
+
+
+class ReportConversions(WindowedVoluum):
     keys = {
         "p_key": [
             "postbackTimestamp",
@@ -14,7 +21,6 @@ class ReportConversions(Voluum):
             "conversionType",
             "offerName",
             "offerId",
-            "countryName",
             "countryCode",
             "trafficSourceName",
             "trafficSourceId",
@@ -32,35 +38,48 @@ class ReportConversions(Voluum):
             "customVariable7",
         ],
         "incre_key": "_batched_at",
+        "partition_key": "postbackTimestamp",
+        "cluster_key": ["campaignId", "offerId", "countryCode"],
     }
-    schema = [
-        {"name": "clickId", "type": "STRING"},
-        {"name": "conversionType", "type": "STRING"},
-        {"name": "countryCode", "type": "STRING"},
-        {"name": "customVariable1", "type": "STRING"},
-        {"name": "customVariable2", "type": "STRING"},
-        {"name": "customVariable3", "type": "STRING"},
-        {"name": "customVariable4", "type": "STRING"},
-        {"name": "customVariable5", "type": "STRING"},
-        {"name": "customVariable6", "type": "STRING"},
-        {"name": "customVariable7", "type": "STRING"},
-        {"name": "transactionId", "type": "STRING"},
-        {"name": "ip", "type": "STRING"},
-        {"name": "offerId", "type": "STRING"},
-        {"name": "offerName", "type": "STRING"},
-        {"name": "postbackTimestamp", "type": "TIMESTAMP"},
-        {"name": "trafficSourceId", "type": "STRING"},
-        {"name": "trafficSourceName", "type": "STRING"},
-        {"name": "visitTimestamp", "type": "TIMESTAMP"},
-        {"name": "campaignName", "type": "STRING"},
-        {"name": "campaignId", "type": "STRING"},
-        {"name": "creativeId", "type": "STRING"},
-        {"name": "_batched_at", "type": "TIMESTAMP"},
+    fingerprint = True
+    fields = [
+        Field("clickId", "STRING"),
+        Field("conversionType", "STRING"),
+        Field("countryCode", "STRING"),
+        Field("customVariable1", "STRING"),
+        Field("customVariable2", "STRING"),
+        Field("customVariable3", "STRING"),
+        Field("customVariable4", "STRING"),
+        Field("customVariable5", "STRING"),
+        Field("customVariable6", "STRING"),
+        Field("customVariable7", "STRING"),
+        Field("transactionId", "STRING"),
+        Field("ip", "STRING"),
+        Field("offerId", "STRING"),
+        Field("offerName", "STRING"),
+        Field("postbackTimestamp", "TIMESTAMP", convert=to_timestamp),
+        Field("trafficSourceId", "STRING"),
+        Field("trafficSourceName", "STRING"),
+        Field("visitTimestamp", "TIMESTAMP", convert=to_timestamp),
+        Field("campaignName", "STRING"),
+        Field("campaignId", "STRING"),
+        Field("creativeId", "STRING"),
+        Field("_batched_at", "TIMESTAMP", column=None),
+    ]
+    rollups = [
+        Rollup(
+            "hourly",
+            "HOUR",
+            ["campaignId", "offerId", "countryCode"],
+            {"conversions": "COUNT(*)"},
+        ),
+        Rollup(
+            "daily",
+            "DAY",
+            ["campaignId", "offerId", "countryCode"],
+            {"conversions": "COUNT(*)"},
+        ),
     ]
-
-    def __init__(self, start, end):
-        super().__init__()
-        self.start, self.end = self._get_time_range(start, end)
 
     def _get_time_range(self, _start, _end):
         if _start and _end:
@@ -68,93 +87,36 @@ class ReportConversions(Voluum):
             end = datetime.strptime(_end, DATE_FORMAT)
         else:
             end = NOW
-            query = f"""
-            SELECT MAX({self.keys['incre_key']}) AS incre
-            FROM `{DATASET}`.`{self.table}`
-            """
-            rows = BQ_CLIENT.query(query).result()
-            row = [dict(row) for row in rows][0]
-            start = row["incre"].astimezone(pytz.timezone(TZ))
+            watermark = get_watermark(self.table, self.keys)
+            if watermark is None:
+                watermark = pytz.utc.localize(NOW - timedelta(days=INITIAL_LOOKBACK))
+            start = watermark.astimezone(pytz.timezone(TZ))
         return start, end
 
-    def _get(self, session, headers, offset=0):
-        limit = 10000
-        with session.get(
+    def _checkpoint(self):
+        super()._checkpoint()
+        if not self.backfill:
+            set_watermark(self.table, self.end)
+
+    def _get_windows(self, session, start):
+        return get_windows(
+            session,
             f"{BASE_URL}/report/conversions",
-            params={
-                "from": self.start.strftime("%Y-%m-%dT%H"),
-                "to": self.end.strftime("%Y-%m-%dT%H"),
-                "tz": TZ,
-                "column": [
-                    "postbackTimestamp",
-                    "visitTimestamp",
-                    "clickId",
-                    "conversionType",
-                    "offerName",
-                    "offerId",
-                    "countryCode",
-                    "trafficSourceName",
-                    "trafficSourceId",
-                    "transactionId",
-                    "ip",
-                    "campaignName",
-                    "campaignId",
-                    "creativeId",
-                    "customVariable1",
-                    "customVariable2",
-                    "customVariable3",
-                    "customVariable4",
-                    "customVariable5",
-                    "customVariable6",
-                    "customVariable7",
-                    "countryName",
-                    "deviceName",
-                    "os",
-                    "osVersion",
-                    "browser",
-                ],
-                "limit": limit,
-                "offset": offset,
-            },
-            headers=headers,
-        ) as r:
-            r.raise_for_status()
-            res = r.json()
-        rows = res["rows"]
-        if rows:
-            return rows + self._get(session, headers, offset + limit)
-        else:
-            return []
+            self._params(),
+            start,
+            self.end,
+        )
 
-    def _transform(self, rows):
-        def transform_dt(x):
-            dt = datetime.strptime(x, "%Y-%m-%d %I:%M:%S %p")
-            return pytz.timezone(TZ).localize(dt).isoformat(timespec="seconds")
+    def _get_window(self, session, window):
+        return {}, fetch_window(
+            session,
+            f"{BASE_URL}/report/conversions",
+            self._params(),
+            window,
+        )
 
-        return [
-            {
-                "postbackTimestamp": transform_dt(row["postbackTimestamp"]),
-                "visitTimestamp": transform_dt(row["visitTimestamp"]),
-                "clickId": row["clickId"],
-                "conversionType": row["conversionType"],
-                "offerName": row["offerName"],
-                "offerId": row["offerId"],
-                "countryCode": row["countryCode"],
-                "trafficSourceName": row["trafficSourceName"],
-                "trafficSourceId": row["trafficSourceId"],
-                "transactionId": row["transactionId"],
-                "ip": row["ip"],
-                "campaignName": row["campaignName"],
-                "campaignId": row["campaignId"],
-                "creativeId": row["creativeId"],
-                "customVariable1": row["customVariable1"],
-                "customVariable2": row["customVariable2"],
-                "customVariable3": row["customVariable3"],
-                "customVariable4": row["customVariable4"],
-                "customVariable5": row["customVariable5"],
-                "customVariable6": row["customVariable6"],
-                "customVariable7": row["customVariable7"],
-                "_batched_at": NOW.isoformat(timespec="seconds"),
-            }
-            for row in rows
-        ]
+    def _params(self):
+        return {
+            "tz": TZ,
+            "column": self.columns,
+        }
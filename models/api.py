@@ -0,0 +1,277 @@
+import os
+import json
+import uuid
+import time
+import random
+import threading
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from models.settings import BASE_URL, MAX_WORKERS
+from models.metrics import timer, count
+
+RATE_LIMIT = float(os.getenv("RATE_LIMIT", 2))
+RATE_BURST = int(os.getenv("RATE_BURST", 2))
+HTTP_TIMEOUT = (
+    float(os.getenv("HTTP_CONNECT_TIMEOUT", 10)),
+    float(os.getenv("HTTP_READ_TIMEOUT", 120)),
+)
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 5))
+HTTP_BACKOFF = 1
+HTTP_BACKOFF_MAX = 60
+HTTP_RETRY_STATUSES = {429, 500, 502, 503, 504}
+CIRCUIT_THRESHOLD = 10
+CIRCUIT_COOLDOWN = 60
+
+
+TOKEN_CACHE_PATH = os.getenv("TOKEN_CACHE_PATH")
+TOKEN_TTL = timedelta(hours=1)
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+
+class RateLimiter:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst,
+                    self.tokens + (now - self.updated_at) * self.rate,
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+RATE_LIMITER = RateLimiter(RATE_LIMIT, RATE_BURST)
+
+
+class CircuitBreaker:
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def check(self):
+        """Wait out the cooldown of an open circuit, then let requests probe it."""
+        with self.lock:
+            if self.opened_at is None:
+                return
+            delay = self.opened_at + self.cooldown - time.monotonic()
+        if delay > 0:
+            with timer("circuit_wait"):
+                time.sleep(delay)
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+CIRCUIT_BREAKER = CircuitBreaker(CIRCUIT_THRESHOLD, CIRCUIT_COOLDOWN)
+
+
+def get_backoff(attempt, r=None):
+    retry_after = r.headers.get("Retry-After") if r is not None else None
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0), HTTP_BACKOFF_MAX)
+        except ValueError:
+            pass
+        try:
+            delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            return min(max(delay, 0), HTTP_BACKOFF_MAX)
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF * 2 ** attempt))
+
+
+def get_session(pool_size=MAX_WORKERS):
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=0,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+@lru_cache(maxsize=None)
+def get_shared_session(pool_size=MAX_WORKERS):
+    return get_session(pool_size)
+
+
+def request(session, method, url, **kwargs):
+    for attempt in range(HTTP_RETRIES + 1):
+        CIRCUIT_BREAKER.check()
+        with timer("rate_limit_wait"):
+            RATE_LIMITER.acquire()
+        count("api_calls")
+        try:
+            with timer("http"):
+                r = session.request(method, url, timeout=HTTP_TIMEOUT, **kwargs)
+                count("bytes_downloaded", len(r.content))
+        except (requests.ConnectionError, requests.Timeout):
+            CIRCUIT_BREAKER.failure()
+            if attempt == HTTP_RETRIES:
+                raise
+            count("api_retries")
+            with timer("backoff"):
+                time.sleep(get_backoff(attempt))
+            continue
+        if r.status_code >= 500:
+            CIRCUIT_BREAKER.failure()
+        else:
+            CIRCUIT_BREAKER.success()
+        if r.status_code not in HTTP_RETRY_STATUSES or attempt == HTTP_RETRIES:
+            return r
+        r.close()
+        count("api_retries")
+        with timer("backoff"):
+            time.sleep(get_backoff(attempt, r))
+
+
+def get_json(session, url, params):
+    for retry in (True, False):
+        headers = get_headers(session)
+        with request(session, "GET", url, params=params, headers=headers) as r:
+            if r.status_code == 401 and retry:
+                TOKENS.invalidate(headers["cwauth-token"])
+                continue
+            r.raise_for_status()
+            return r.json()
+
+
+def paginate(session, url, params, limit=10000):
+    """Yield pages until totalRows is reached, or until an empty page.
+
+    The API may return fewer rows than requested, so a short page does not
+    mean the last page.
+    """
+    offset = 0
+    while True:
+        res = get_json(
+            session,
+            url,
+            {**params, "limit": limit, "offset": offset},
+        )
+        rows = res["rows"]
+        count("pages")
+        if not rows:
+            return
+        yield rows
+        offset += len(rows)
+        if res.get("totalRows") is not None and offset >= res["totalRows"]:
+            return
+
+
+class TokenCache:
+    def __init__(self, path=None):
+        self.path = path
+        self.token = None
+        self.expires_at = datetime.min
+        self.loaded = not path
+        self.lock = threading.Lock()
+
+    def _load(self):
+        self.loaded = True
+        try:
+            with open(self.path) as f:
+                cache = json.load(f)
+            token = cache["token"]
+            expires_at = datetime.fromisoformat(cache["expires_at"])
+        except (OSError, ValueError, TypeError, KeyError):
+            return
+        self.token, self.expires_at = token, expires_at
+
+    def _dump(self):
+        tmp = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(
+                {
+                    "token": self.token,
+                    "expires_at": self.expires_at.isoformat(),
+                },
+                f,
+            )
+        os.replace(tmp, self.path)
+
+    def _login(self, session):
+        count("logins")
+        with timer("login"), request(
+            session,
+            "POST",
+            f"{BASE_URL}/auth/session",
+            data=json.dumps(
+                {
+                    "email": os.getenv("EMAIL"),
+                    "password": os.getenv("VPWD"),
+                }
+            ),
+            headers={
+                "Content-Type": "application/json",
+                "Accept": "application/json",
+            },
+        ) as r:
+            r.raise_for_status()
+            res = r.json()
+        self.token = res["token"]
+        if res.get("expirationTimestamp"):
+            self.expires_at = datetime.strptime(
+                res["expirationTimestamp"][:19],
+                "%Y-%m-%dT%H:%M:%S",
+            )
+        else:
+            self.expires_at = datetime.utcnow() + TOKEN_TTL
+        if self.path:
+            self._dump()
+
+    def get(self, session):
+        with self.lock:
+            if not self.loaded:
+                self._load()
+            if (
+                not self.token
+                or datetime.utcnow() + TOKEN_REFRESH_MARGIN >= self.expires_at
+            ):
+                self._login(session)
+            return self.token
+
+    def invalidate(self, token):
+        with self.lock:
+            if self.token == token:
+                self.token = None
+
+
+TOKENS = TokenCache(TOKEN_CACHE_PATH)
+
+
+def get_headers(session):
+    return {
+        "cwauth-token": TOKENS.get(session),
+    }
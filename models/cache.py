@@ -0,0 +1,104 @@
+import os
+import gzip
+import json
+import hashlib
+import uuid
+import tempfile
+import threading
+from abc import ABCMeta, abstractmethod
+
+from models.metrics import count
+
+CACHE_STORE = os.getenv("CACHE_STORE", "file")
+CACHE_PATH = os.getenv(
+    "CACHE_PATH",
+    os.path.join(tempfile.gettempdir(), "palma_voluum_cache"),
+)
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", 256 * 1024 * 1024))
+CACHE_SETTLED_DAYS = int(os.getenv("CACHE_SETTLED_DAYS", 7))
+
+
+def cache_key(params):
+    return hashlib.blake2b(
+        json.dumps(params, sort_keys=True).encode("utf-8"),
+        digest_size=16,
+    ).hexdigest()
+
+
+class ResponseCache(metaclass=ABCMeta):
+    @abstractmethod
+    def get(self, key):
+        pass
+
+    @abstractmethod
+    def set(self, key, value):
+        pass
+
+
+class NullResponseCache(ResponseCache):
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+
+class FileResponseCache(ResponseCache):
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.path, f"{key}.json.gz")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rt") as f:
+                value = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            count("cache_misses")
+            return None
+        count("cache_hits")
+        return value
+
+    def set(self, key, value):
+        os.makedirs(self.path, exist_ok=True)
+        path = self._path(key)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with gzip.open(tmp, "wt") as f:
+            json.dump(value, f)
+        os.replace(tmp, path)
+        self._evict()
+
+    def _evict(self):
+        with self.lock:
+            entries = []
+            for entry in os.scandir(self.path):
+                if entry.name.endswith(".json.gz"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            size = sum(entry[1] for entry in entries)
+            for _, entry_size, path in sorted(entries):
+                if size <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                    count("cache_evictions")
+                except FileNotFoundError:
+                    pass
+                size -= entry_size
+
+
+def get_response_cache(store):
+    if store == "file":
+        return FileResponseCache(CACHE_PATH, CACHE_MAX_SIZE)
+    elif store == "none":
+        return NullResponseCache()
+    else:
+        raise ValueError(store)
+
+
+RESPONSE_CACHE = get_response_cache(CACHE_STORE)
@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import random
+import base64
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from datetime import datetime
+from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
+
+import pytz
+
+from models.settings import DATASET
+from models.client import run_query
+from models.metrics import log
+from models.sinks import SINK, SINK_TYPE
+
+CHECKPOINT_STORE = os.getenv(
+    "CHECKPOINT_STORE",
+    "bigquery" if SINK_TYPE == "bigquery" else "file",
+)
+CHECKPOINT_PATH = os.getenv(
+    "CHECKPOINT_PATH",
+    os.path.join(tempfile.gettempdir(), "palma_voluum_checkpoints.json"),
+)
+CHECKPOINT_TABLE = "_checkpoints"
+CHECKPOINT_TTL = float(os.getenv("CHECKPOINT_TTL", 60))
+CHECKPOINT_RETRIES = 5
+CHECKPOINT_MAX_SIZE = 8 * 1024 * 1024
+
+
+class CheckpointStore(metaclass=ABCMeta):
+    def __init__(self, ttl=CHECKPOINT_TTL):
+        self.ttl = ttl
+        self.checkpoints = {}
+        self.lock = threading.Lock()
+
+    @abstractmethod
+    def _read(self, key):
+        pass
+
+    @abstractmethod
+    def _write(self, key, value):
+        pass
+
+    @abstractmethod
+    def _delete(self, key):
+        pass
+
+    def get(self, key, cached=True):
+        with self.lock:
+            entry = self.checkpoints.get(key)
+            if cached and entry and time.monotonic() - entry[1] < self.ttl:
+                return entry[0]
+            value = self._read(key)
+            self.checkpoints[key] = (value, time.monotonic())
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self._write(key, value)
+            self.checkpoints[key] = (value, time.monotonic())
+
+    def delete(self, key):
+        with self.lock:
+            self._delete(key)
+            self.checkpoints.pop(key, None)
+
+
+class MemoryCheckpointStore(CheckpointStore):
+    def __init__(self):
+        super().__init__(ttl=float("inf"))
+        self.values = {}
+
+    def _read(self, key):
+        return self.values.get(key)
+
+    def _write(self, key, value):
+        self.values[key] = value
+
+    def _delete(self, key):
+        self.values.pop(key, None)
+
+
+class FileCheckpointStore(CheckpointStore):
+    def __init__(self, path, ttl=CHECKPOINT_TTL):
+        super().__init__(ttl)
+        self.path = path
+
+    @contextmanager
+    def _locked(self):
+        with open(f"{self.path}.lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _dump(self, checkpoints):
+        tmp = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(checkpoints, f)
+        os.replace(tmp, self.path)
+
+    def _read(self, key):
+        with self._locked():
+            return self._load().get(key)
+
+    def _write(self, key, value):
+        with self._locked():
+            self._dump({**self._load(), key: value})
+
+    def _delete(self, key):
+        with self._locked():
+            checkpoints = self._load()
+            if checkpoints.pop(key, None) is not None:
+                self._dump(checkpoints)
+
+
+class BigQueryCheckpointStore(CheckpointStore):
+    def __init__(self, table, ttl=CHECKPOINT_TTL):
+        super().__init__(ttl)
+        self.table = table
+        self.created = False
+
+    def _query(self, query, params):
+        from google.api_core.exceptions import BadRequest
+
+        for attempt in range(CHECKPOINT_RETRIES + 1):
+            try:
+                return run_query(query, params)
+            except BadRequest as e:
+                if "concurrent update" not in str(e) or attempt == CHECKPOINT_RETRIES:
+                    raise
+                time.sleep(random.uniform(0, 2 ** attempt))
+
+    def _read(self, key):
+        from google.api_core.exceptions import NotFound
+
+        query = f"""
+        SELECT value
+        FROM `{DATASET}`.`{self.table}`
+        WHERE key = @key
+        ORDER BY updated_at DESC
+        LIMIT 1
+        """
+        try:
+            rows = [dict(row) for row in self._query(query, {"key": key})]
+        except NotFound:
+            return None
+        return json.loads(rows[0]["value"]) if rows else None
+
+    def _write(self, key, value):
+        if not self.created:
+            run_query(
+                f"""
+            CREATE TABLE IF NOT EXISTS `{DATASET}`.`{self.table}` (
+                key STRING,
+                value STRING,
+                updated_at TIMESTAMP
+            )
+            """
+            )
+            self.created = True
+        query = f"""
+        MERGE `{DATASET}`.`{self.table}` T
+        USING (SELECT @key AS key, @value AS value) S
+        ON T.key = S.key
+        WHEN MATCHED THEN
+            UPDATE SET value = S.value, updated_at = CURRENT_TIMESTAMP()
+        WHEN NOT MATCHED THEN
+            INSERT (key, value, updated_at)
+            VALUES (S.key, S.value, CURRENT_TIMESTAMP())
+        """
+        self._query(query, {"key": key, "value": json.dumps(value)})
+
+    def _delete(self, key):
+        from google.api_core.exceptions import NotFound
+
+        query = f"""
+        DELETE FROM `{DATASET}`.`{self.table}`
+        WHERE key = @key
+        """
+        try:
+            self._query(query, {"key": key})
+        except NotFound:
+            pass
+
+
+def get_checkpoint_store(store):
+    if store == "bigquery":
+        return BigQueryCheckpointStore(CHECKPOINT_TABLE)
+    elif store == "file":
+        return FileCheckpointStore(CHECKPOINT_PATH)
+    elif store == "memory":
+        return MemoryCheckpointStore()
+    else:
+        raise ValueError(store)
+
+
+CHECKPOINTS = get_checkpoint_store(CHECKPOINT_STORE)
+
+
+def get_watermark(table, keys):
+    watermark = CHECKPOINTS.get(f"{table}.watermark")
+    if watermark:
+        return datetime.fromisoformat(watermark)
+    return query_watermark(table, keys)
+
+
+def set_watermark(table, value):
+    value = pytz.utc.localize(value) if value.tzinfo is None else value
+    watermark = CHECKPOINTS.get(f"{table}.watermark")
+    if not watermark or datetime.fromisoformat(watermark) < value:
+        CHECKPOINTS.set(f"{table}.watermark", value.isoformat())
+
+
+def query_watermark(table, keys):
+    return SINK.query_watermark(table, keys)
+
+
+def get_digests(table):
+    digests = CHECKPOINTS.get(f"{table}.digests", cached=False)
+    if not digests:
+        return {}
+    digests = array("Q", base64.b64decode(digests))
+    return dict(zip(digests[::2], digests[1::2]))
+
+
+def set_digests(table, digests):
+    CHECKPOINTS.set(
+        f"{table}.digests",
+        base64.b64encode(
+            array("Q", chain.from_iterable(digests.items())).tobytes()
+        ).decode("ascii"),
+    )
+
+
+def drop_digests(table):
+    CHECKPOINTS.delete(f"{table}.digests")
+
+
+class Fingerprints:
+    __slots__ = ("keys", "times")
+
+    def __init__(self, keys=(), times=()):
+        pairs = sorted(zip(keys, times))
+        self.keys = array("Q", (key for key, _ in pairs))
+        self.times = array("Q", (time_ for _, time_ in pairs))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        i = bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def merge(self, keys, times, cutoff, size):
+        latest = {}
+        for key, time_ in chain(zip(self.keys, self.times), zip(keys, times)):
+            if time_ >= cutoff and latest.get(key, 0) < time_:
+                latest[key] = time_
+        pairs = sorted(latest.items(), key=lambda pair: pair[1])[-size:]
+        return Fingerprints([key for key, _ in pairs], [time_ for _, time_ in pairs])
+
+
+def get_fingerprints(table):
+    fingerprints = CHECKPOINTS.get(f"{table}.fingerprints", cached=False)
+    if not fingerprints:
+        return Fingerprints()
+    pairs = array("Q", base64.b64decode(fingerprints))
+    return Fingerprints(pairs[::2], pairs[1::2])
+
+
+def set_fingerprints(table, fingerprints):
+    # Stored as one base64 query parameter, which must stay under BigQuery's
+    # 10 MB request limit: 16 bytes per entry, 4/3 for base64.
+    size = CHECKPOINT_MAX_SIZE * 3 // 4 // 16
+    if len(fingerprints) > size:
+        log(
+            "fingerprints_truncated",
+            table=table,
+            kept=size,
+            dropped=len(fingerprints) - size,
+        )
+        fingerprints = fingerprints.merge((), (), 0, size)
+    CHECKPOINTS.set(
+        f"{table}.fingerprints",
+        base64.b64encode(
+            array(
+                "Q",
+                chain.from_iterable(zip(fingerprints.keys, fingerprints.times)),
+            ).tobytes()
+        ).decode("ascii"),
+    )
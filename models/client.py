@@ -0,0 +1,36 @@
+import threading
+
+from models.metrics import timer, count
+
+BQ_CLIENT = None
+BQ_CLIENT_LOCK = threading.Lock()
+
+
+def get_client():
+    global BQ_CLIENT
+    if BQ_CLIENT is None:
+        with BQ_CLIENT_LOCK:
+            if BQ_CLIENT is None:
+                from google.cloud import bigquery
+
+                with timer("bq_client"):
+                    BQ_CLIENT = bigquery.Client()
+    return BQ_CLIENT
+
+
+def run_query(query, params=None):
+    from google.cloud import bigquery
+
+    job = get_client().query(
+        query,
+        job_config=bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter(name, "STRING", value)
+                for name, value in (params or {}).items()
+            ]
+        ),
+    )
+    rows = job.result()
+    count("bq_bytes_processed", job.total_bytes_processed or 0)
+    count("bq_slot_ms", job.slot_millis or 0)
+    return rows
@@ -0,0 +1,52 @@
+import json
+import time
+import threading
+from collections import defaultdict
+from contextlib import nullcontext, contextmanager
+from contextvars import ContextVar
+
+
+class Metrics:
+    def __init__(self):
+        self.timings = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, name):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.timings[name] += time.perf_counter() - started_at
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "timings": {k: round(v, 3) for k, v in self.timings.items()},
+                "counters": dict(self.counters),
+            }
+
+
+METRICS = ContextVar("metrics", default=None)
+METRICS_HOOKS = []
+
+
+def timer(name):
+    metrics = METRICS.get()
+    return metrics.timer(name) if metrics else nullcontext()
+
+
+def count(name, value=1):
+    metrics = METRICS.get()
+    if metrics:
+        metrics.count(name, value)
+
+
+def log(message, **kwargs):
+    print(json.dumps({"severity": "INFO", "message": message, **kwargs}))
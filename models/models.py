@@ -1,46 +1,266 @@
 import os
-import json
-from datetime import datetime
+import math
+import time
+import hashlib
+import uuid
+import threading
 import importlib
+from array import array
+from collections import deque
+from datetime import datetime, timedelta
 from abc import ABCMeta, abstractmethod
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Full
 
-import requests
-from google.cloud import bigquery
+import pytz
 
+from models.settings import NOW, TABLES, MAX_WORKERS
+from models.metrics import Metrics, METRICS, METRICS_HOOKS, timer, count, log
+from models.api import get_shared_session, get_headers, get_json, paginate
+from models.timestamps import to_datetime
+from models.sinks import SINK
+from models.checkpoints import (
+    CHECKPOINTS,
+    get_digests,
+    set_digests,
+    drop_digests,
+    get_fingerprints,
+    set_fingerprints,
+)
 
-NOW = datetime.utcnow()
-DATE_FORMAT = "%Y-%m-%d"
-TZ = "America/Los_Angeles"
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", 50000))
+WINDOW_ROWS = int(os.getenv("WINDOW_ROWS", 50000))
+WINDOW_FORMAT = "%Y-%m-%dT%H"
+UPDATE_MODE = os.getenv("UPDATE_MODE", "merge")
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "overlap")
+PIPELINE_DEPTH = int(os.getenv("PIPELINE_DEPTH", 2))
+FINGERPRINT_HOURS = int(os.getenv("FINGERPRINT_HOURS", 2))
+FINGERPRINT_MAX = int(os.getenv("FINGERPRINT_MAX", 2 ** 18))
 
-BASE_URL = "https://api.voluum.com"
 
-BQ_CLIENT = bigquery.Client()
-DATASET = "Palma"
+def imap(fn, items, workers=MAX_WORKERS):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = deque()
+        for item in items:
+            futures.append(executor.submit(copy_context().run, fn, item))
+            if len(futures) > workers:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
 
 
-def get_headers(session):
-    with session.post(
-        f"{BASE_URL}/auth/session",
-        data=json.dumps(
-            {
-                "email": os.getenv("EMAIL"),
-                "password": os.getenv("VPWD"),
-            }
-        ),
-        headers={
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-        },
-    ) as r:
-        res = r.json()
+def prefetch(items, depth=PIPELINE_DEPTH):
+    queue = Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as e:
+            put((None, e))
+
+    thread = threading.Thread(target=copy_context().run, args=(produce,), daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = queue.get()
+            if error:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def window_params(window):
+    start, end = window
     return {
-        "cwauth-token": res["token"],
+        "from": start.strftime(WINDOW_FORMAT),
+        "to": end.strftime(WINDOW_FORMAT),
     }
 
 
+def plan_windows(windows, counts, target=WINDOW_ROWS):
+    planned = []
+    merged, merged_rows = None, 0
+    for (start, end), rows in zip(windows, counts):
+        if rows is not None and rows <= target:
+            if merged and merged_rows + rows <= target:
+                merged, merged_rows = (merged[0], end), merged_rows + rows
+                continue
+            if merged:
+                planned.append(merged)
+            merged, merged_rows = (start, end), rows
+            continue
+        if merged:
+            planned.append(merged)
+            merged, merged_rows = None, 0
+        if rows is None:
+            planned.append((start, end))
+            continue
+        hours = math.ceil((end - start) / timedelta(hours=1))
+        pieces = max(1, min(hours, math.ceil(rows / target)))
+        bounds = [
+            start + timedelta(hours=round(i * hours / pieces)) for i in range(pieces)
+        ] + [end]
+        planned.extend(zip(bounds, bounds[1:]))
+    if merged:
+        planned.append(merged)
+    return planned
+
+
+def get_windows(session, url, params, start, end):
+    start = start.replace(tzinfo=None, minute=0, second=0, microsecond=0)
+    end = end.replace(tzinfo=None)
+    windows = []
+    while start < end:
+        windows.append((start, min(start + timedelta(days=1), end)))
+        start += timedelta(days=1)
+    counts = imap(
+        lambda window: get_json(
+            session,
+            url,
+            {**params, **window_params(window), "limit": 1, "offset": 0},
+        ).get("totalRows"),
+        windows,
+    )
+    return plan_windows(windows, counts)
+
+
+def fetch_window(session, url, params, window):
+    return [
+        row
+        for rows in paginate(session, url, {**params, **window_params(window)})
+        for row in rows
+    ]
+
+
+class Field:
+    __slots__ = ("name", "type", "description", "column", "convert")
+
+    def __init__(self, name, type, description=None, column=True, convert=None):
+        self.name = name
+        self.type = type
+        self.description = description
+        self.column = name if column is True else column
+        self.convert = convert
+
+    def to_schema(self):
+        schema = {"name": self.name, "type": self.type}
+        if self.description:
+            schema["description"] = self.description
+        return schema
+
+
+class Rollup:
+    __slots__ = ("suffix", "grain", "dimensions", "metrics")
+
+    def __init__(self, suffix, grain, dimensions, metrics):
+        self.suffix = suffix
+        self.grain = grain
+        self.dimensions = dimensions
+        self.metrics = metrics
+
+    @property
+    def column(self):
+        return self.grain.split("(")[0].lower()
+
+
+def compile_projector(fields):
+    env = {}
+    values = []
+    for i, field in enumerate(fields):
+        value = f"row.get({field.column!r})"
+        if field.convert:
+            env[f"convert_{i}"] = field.convert
+            value = f"convert_{i}({value})"
+        values.append(value)
+    exec(f"def project(row):\n    return ({', '.join(values)},)", env)
+    return env["project"]
+
+
+class Batch:
+    __slots__ = ("names", "segments", "size")
+
+    def __init__(self, names):
+        self.names = names
+        self.segments = []
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, context, rows):
+        self.segments.append((context, rows))
+        self.size += len(rows)
+
+    def records(self):
+        for context, rows in self.segments:
+            for row in rows:
+                yield {**dict(zip(self.names, row)), **context}
+
+    def column(self, name):
+        values = []
+        if name in self.names:
+            i = self.names.index(name)
+            for _, rows in self.segments:
+                values.extend(row[i] for row in rows)
+        else:
+            for context, rows in self.segments:
+                values.extend([context.get(name)] * len(rows))
+        return values
+
+
+def digest(values):
+    return int.from_bytes(
+        hashlib.blake2b(repr(values).encode("utf-8"), digest_size=8).digest(),
+        "little",
+    )
+
+
+def make_getter(names, columns, context):
+    positions = [columns.index(name) if name in columns else None for name in names]
+    constants = [context.get(name) for name in names]
+    return lambda row: tuple(
+        row[i] if i is not None else constant
+        for i, constant in zip(positions, constants)
+    )
+
+
+def batched(segments, size, names):
+    batch = Batch(names)
+    for context, rows in segments:
+        while rows:
+            chunk, rows = rows[: size - len(batch)], rows[size - len(batch) :]
+            batch.append(context, chunk)
+            if len(batch) >= size:
+                yield batch
+                batch = Batch(names)
+    if batch:
+        yield batch
+
+
 class Voluum(metaclass=ABCMeta):
     @staticmethod
     def factory(table, start, end):
+        if table not in TABLES:
+            raise ValueError(table)
         try:
             module = importlib.import_module(f"models.{table}")
             model = getattr(module, table)
@@ -55,73 +275,346 @@ class Voluum(metaclass=ABCMeta):
 
     @property
     @abstractmethod
-    def schema(self):
+    def fields(self):
         pass
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if isinstance(cls.__dict__.get("fields"), list):
+            cls.schema = [field.to_schema() for field in cls.fields]
+            if "columns" not in cls.__dict__:
+                cls.columns = [field.column for field in cls.fields if field.column]
+            cls.names = [field.name for field in cls.fields if field.column]
+            cls.constants = [field.name for field in cls.fields if not field.column]
+            cls._project = staticmethod(
+                compile_projector([field for field in cls.fields if field.column])
+            )
+        if isinstance(getattr(cls, "keys", None), dict) and hasattr(cls, "schema"):
+            names = {field["name"] for field in cls.schema}
+            for name in [
+                *cls.keys["p_key"],
+                cls.keys["partition_key"],
+                *cls.keys["cluster_key"],
+            ]:
+                if name not in names:
+                    raise ValueError(f"{cls.__name__}: {name} is not in schema")
+
+    batch_size = BATCH_SIZE
+    update_mode = UPDATE_MODE
+    pipeline_mode = PIPELINE_MODE
+    load_format = "json"
+    backfill = False
+    dedup = False
+    fingerprint = False
+    rollups = []
+    partitions = None
+
     def __init__(self):
         self.table = self.__class__.__name__
+        self.run_id = uuid.uuid4().hex[:12]
 
-    @abstractmethod
-    def _get(self, session, headers):
-        pass
+    @property
+    def stage(self):
+        if self.update_mode != "merge":
+            return f"_stage_{self.table}"
+        elif self.backfill:
+            return f"_stage_{self.table}_{self.start:%Y%m%d}_{self.end:%Y%m%d}"
+        else:
+            return f"_stage_{self.table}_{self.run_id}"
+
+    @property
+    def backfill_key(self):
+        return f"{self.table}.backfill.{self.start:%Y-%m-%d}.{self.end:%Y-%m-%d}"
 
     @abstractmethod
-    def _transform(self, rows):
+    def _get(self, session):
         pass
 
-    def _load(self, rows):
-        output_rows = (
-            BQ_CLIENT.load_table_from_json(
-                rows,
-                f"{DATASET}._stage_{self.table}",
-                job_config=bigquery.LoadJobConfig(
-                    create_disposition="CREATE_IF_NEEDED",
-                    write_disposition="WRITE_APPEND",
-                    schema=self.schema,
-                ),
-            )
-            .result()
-            .output_rows
+    def _transform(self, segments):
+        project = self._project
+        batched_at = NOW.isoformat(timespec="seconds")
+        for context, rows in segments:
+            context = {"_batched_at": batched_at, **context}
+            with timer("transform"):
+                rows = [project(row) for row in rows]
+            count("rows_fetched", len(rows))
+            yield {name: context[name] for name in self.constants}, rows
+
+    def _dedup(self, segments):
+        p_key = self.keys["p_key"]
+        excluded = {*p_key, self.keys["incre_key"], "_batched_at"}
+        value_names = [
+            name for name in self.names + self.constants if name not in excluded
+        ]
+        for context, rows in segments:
+            get_key = make_getter(p_key, self.names, context)
+            get_value = make_getter(value_names, self.names, context)
+            kept = []
+            with timer("dedup"):
+                for row in rows:
+                    key, value = digest(get_key(row)), digest(get_value(row))
+                    self.digests[key] = value
+                    if self.previous_digests.get(key) != value:
+                        kept.append(row)
+            self.num_skipped += len(rows) - len(kept)
+            yield context, kept
+
+    def _drop_seen(self, segments):
+        columns = {field.name: field.column for field in self.fields if field.column}
+        key_columns = [columns[name] for name in self.keys["p_key"]]
+        partition = next(
+            field for field in self.fields if field.name == self.keys["partition_key"]
         )
-        self._update()
-        return output_rows
+        end = self.end if self.end.tzinfo else pytz.utc.localize(self.end)
+        self.cutoff = int(end.timestamp()) - FINGERPRINT_HOURS * 3600
+        for context, rows in segments:
+            kept = []
+            with timer("fingerprint"):
+                for row in rows:
+                    key = digest(tuple(row.get(column) for column in key_columns))
+                    if key not in self.previous_fingerprints:
+                        kept.append(row)
+                    value = row.get(partition.column)
+                    if value and partition.convert:
+                        value = partition.convert(value)
+                    if value:
+                        time_ = int(to_datetime(value).timestamp())
+                        if time_ >= self.cutoff:
+                            self.fingerprint_keys.append(key)
+                            self.fingerprint_times.append(time_)
+            self.num_skipped += len(rows) - len(kept)
+            yield context, kept
+
+    def _load(self, batch):
+        return self._wait([self._submit(batch)])
+
+    def _submit(self, batch):
+        self._track_partitions(batch)
+        job = SINK.submit(self, batch)
+        self.jobs.append(job)
+        return job
+
+    def _track_partitions(self, batch):
+        values = [
+            x if isinstance(x, datetime) else to_datetime(x)
+            for x in set(batch.column(self.keys["partition_key"]))
+            if x
+        ]
+        if values:
+            lo, hi = min(values), max(values)
+            if self.partitions:
+                lo, hi = min(lo, self.partitions[0]), max(hi, self.partitions[1])
+            self.partitions = lo, hi
+
+    def _wait(self, jobs):
+        with timer("load_wait"):
+            return SINK.wait(jobs)
+
+    def _settle(self):
+        """Wait out load jobs still running after a failure.
+
+        Otherwise a job could create the stage again after cleanup drops it.
+        """
+        jobs, self.jobs = self.jobs, []
+        for job in jobs:
+            try:
+                SINK.wait([job])
+            except Exception:
+                pass
 
     def _update(self):
-        query = f"""
-        CREATE OR REPLACE TABLE `{DATASET}`.`{self.table}` AS
-        SELECT * EXCEPT (row_num) FROM
-        (
-            SELECT
-                *,
-                ROW_NUMBER() over (
-                    PARTITION BY {','.join(self.keys['p_key'])}
-                    ORDER BY {self.keys['incre_key']} DESC
-                    ) AS row_num
-                FROM
-                    `{DATASET}`.`_stage_{self.table}`
+        with timer("update"):
+            if self.update_mode == "merge":
+                SINK.merge(self)
+            else:
+                SINK.replace(self)
+
+    def _rollup(self):
+        if self.rollups:
+            with timer("rollup"):
+                SINK.rollup(self)
+
+    def _checkpoint(self):
+        if self.dedup and not self.backfill:
+            set_digests(self.table, self.digests)
+        if self.fingerprint and not self.backfill:
+            set_fingerprints(
+                self.table,
+                self.previous_fingerprints.merge(
+                    self.fingerprint_keys,
+                    self.fingerprint_times,
+                    self.cutoff,
+                    FINGERPRINT_MAX,
+                ),
             )
-        WHERE
-            row_num = 1
-        """
-        BQ_CLIENT.query(query).result()
 
-    def run(self):
-        with requests.Session() as session:
-            rows = self._get(session, get_headers(session))
+    def _staged(self):
+        return SINK.staged(self.stage)
+
+    def _cleanup(self):
+        if self.backfill:
+            CHECKPOINTS.delete(self.backfill_key)
+        if self.update_mode == "merge":
+            SINK.drop(self.stage)
+
+    def _run(self, session):
+        num_processed = output_rows = 0
+        self.num_skipped = 0
+        segments = self._get(session)
+        if self.fingerprint:
+            self.previous_fingerprints = get_fingerprints(self.table)
+            self.fingerprint_keys = array("Q")
+            self.fingerprint_times = array("Q")
+            segments = self._drop_seen(segments)
+        segments = self._transform(segments)
+        if self.dedup:
+            self.previous_digests = get_digests(self.table)
+            self.digests = {}
+            drop_digests(self.table)
+            segments = self._dedup(segments)
+        batches = batched(segments, self.batch_size, self.names)
+        if self.pipeline_mode == "overlap":
+            jobs = []
+            for batch in prefetch(batches):
+                num_processed += len(batch)
+                jobs.append(self._submit(batch))
+            return num_processed, self._wait(jobs)
+        for batch in batches:
+            num_processed += len(batch)
+            output_rows += self._load(batch)
+        return num_processed, output_rows
+
+    def _run_backfill(self, session):
+        num_processed = output_rows = 0
+        windows = self._get_backfill(session)
+        if self.pipeline_mode == "overlap":
+            windows = prefetch(windows)
+        for window, segment in windows:
+            segments = self._transform([segment])
+            jobs = []
+            for batch in batched(segments, self.batch_size, self.names):
+                num_processed += len(batch)
+                jobs.append(self._submit(batch))
+            output_rows += self._wait(jobs)
+            CHECKPOINTS.set(self.backfill_key, window[1].isoformat())
+        return num_processed, output_rows
+
+    def run(self, session=None):
+        metrics = Metrics()
+        token = METRICS.set(metrics)
+        try:
+            with metrics.timer("total"):
+                response = self._run_pipeline(session)
+        finally:
+            METRICS.reset(token)
+        response = {**response, "metrics": metrics.to_dict()}
+        log("run", **response)
+        for hook in METRICS_HOOKS:
+            hook(self.table, response["metrics"])
+        return response
+
+    def _run_pipeline(self, session):
         response = {
             "table": self.table,
         }
         if getattr(self, "start", None) and getattr(self, "end", None):
             response = {
                 **response,
-                "start": self.start.isoformat(timespec='seconds'),
-                "end": self.end.isoformat(timespec='seconds'),
+                "start": self.start.isoformat(timespec="seconds"),
+                "end": self.end.isoformat(timespec="seconds"),
             }
-        if len(rows) > 0:
-            rows = self._transform(rows)
+        completed = False
+        self.jobs = []
+        self.partitions = None
+        try:
+            session = session or get_shared_session()
+            if self.backfill:
+                num_processed, output_rows = self._run_backfill(session)
+            else:
+                num_processed, output_rows = self._run(session)
+            if num_processed > 0 or (self.backfill and self._staged()):
+                self._update()
+                self._rollup()
+            self._checkpoint()
+            completed = True
+        finally:
+            if not completed:
+                self._settle()
+            if completed or not self.backfill:
+                self._cleanup()
+        if (self.dedup or self.fingerprint) and not self.backfill:
             response = {
                 **response,
-                "num_processed": len(rows),
-                "output_rows": self._load(rows),
+                "num_skipped": self.num_skipped,
             }
-        return response
+        return {
+            **response,
+            "num_processed": num_processed,
+            "output_rows": output_rows,
+        }
+
+
+class WindowedVoluum(Voluum):
+    """A model fetched window by window between start and end.
+
+    Given both start and end the run is a resumable backfill.
+    """
+
+    def __init__(self, start, end):
+        super().__init__()
+        self.backfill = bool(start and end)
+        self.start, self.end = self._get_time_range(start, end)
+
+    @abstractmethod
+    def _get_time_range(self, start, end):
+        pass
+
+    @abstractmethod
+    def _get_windows(self, session, start):
+        pass
+
+    @abstractmethod
+    def _get_window(self, session, window):
+        pass
+
+    def _get(self, session):
+        return imap(
+            lambda window: self._get_window(session, window),
+            self._get_windows(session, self.start),
+        )
+
+    def _get_backfill(self, session):
+        done = CHECKPOINTS.get(self.backfill_key)
+        start = max(self.start, datetime.fromisoformat(done)) if done else self.start
+        windows = self._get_windows(session, start)
+        return zip(
+            windows,
+            imap(lambda window: self._get_window(session, window), windows),
+        )
+
+
+def run_tables(tables, start, end):
+    if tables == "all":
+        tables = TABLES
+    tables = list(dict.fromkeys(tables))
+    if not tables:
+        raise ValueError(tables)
+
+    def run_table(table):
+        started_at = time.monotonic()
+        try:
+            response = Voluum.factory(table, start, end).run(session)
+        except Exception as e:
+            response = {"table": table, "error": repr(e)}
+        return {**response, "elapsed": round(time.monotonic() - started_at, 3)}
+
+    started_at = time.monotonic()
+    session = get_shared_session(MAX_WORKERS * len(tables))
+    get_headers(session)
+    with ThreadPoolExecutor(max_workers=len(tables)) as executor:
+        results = list(executor.map(run_table, tables))
+    return {
+        "results": results,
+        "failed": [result["table"] for result in results if "error" in result],
+        "elapsed": round(time.monotonic() - started_at, 3),
+    }
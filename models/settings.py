@@ -0,0 +1,11 @@
+import os
+from datetime import datetime
+
+NOW = datetime.utcnow()
+DATE_FORMAT = "%Y-%m-%d"
+TZ = "America/Los_Angeles"
+BASE_URL = os.getenv("VOLUUM_BASE_URL", "https://api.voluum.com")
+TABLES = ["Report", "ReportConversions", "ReportConversions2", "Offer"]
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", 4))
+INITIAL_LOOKBACK = int(os.getenv("INITIAL_LOOKBACK", 7))
+DATASET = "Palma"
@@ -0,0 +1,463 @@
+import os
+import json
+import shutil
+import uuid
+import tempfile
+import threading
+from collections import defaultdict
+from datetime import timezone
+from abc import ABCMeta, abstractmethod
+
+from models.settings import TZ, DATASET
+from models.metrics import timer, count, log
+from models.client import get_client, run_query
+from models.timestamps import to_datetime
+
+SINK_TYPE = os.getenv("SINK_TYPE", "bigquery")
+SINK_PATH = os.getenv(
+    "SINK_PATH",
+    os.path.join(tempfile.gettempdir(), "palma_voluum"),
+)
+SPOOL_SIZE = 64 * 1024 * 1024
+WATERMARK_LOOKBACK = 7
+
+
+ROLLUP_SPANS = {"hour": 1, "day": 2, "week": 8}
+
+
+def to_arrow(values, type_):
+    import pyarrow as pa
+
+    arrow_type = {
+        "STRING": pa.string(),
+        "INTEGER": pa.int64(),
+        "FLOAT": pa.float64(),
+        "BOOLEAN": pa.bool_(),
+        "TIMESTAMP": pa.timestamp("us", tz="UTC"),
+    }[type_]
+    if type_ == "TIMESTAMP":
+        cache = {x: to_datetime(x) for x in set(values) if isinstance(x, str)}
+        values = [cache.get(x, x) if isinstance(x, str) else x for x in values]
+    elif type_ == "STRING":
+        values = [x if x is None or isinstance(x, str) else str(x) for x in values]
+    return pa.array(values, type=arrow_type)
+
+
+def write_parquet(batch, schema, f):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    pq.write_table(
+        pa.table(
+            [to_arrow(batch.column(field["name"]), field["type"]) for field in schema],
+            names=[field["name"] for field in schema],
+        ),
+        f,
+    )
+
+
+def dedup_table(table, p_key, incre_key):
+    import pyarrow.compute as pc
+
+    table = table.take(pc.sort_indices(table, sort_keys=[(incre_key, "descending")]))
+    columns = [table.column(name).to_pylist() for name in p_key]
+    seen = set()
+    indices = []
+    for i, key in enumerate(zip(*columns)):
+        if key not in seen:
+            seen.add(key)
+            indices.append(i)
+    return table.take(indices)
+
+
+class Sink(metaclass=ABCMeta):
+    @abstractmethod
+    def submit(self, model, batch):
+        pass
+
+    @abstractmethod
+    def wait(self, jobs):
+        pass
+
+    @abstractmethod
+    def merge(self, model):
+        pass
+
+    @abstractmethod
+    def replace(self, model):
+        pass
+
+    def rollup(self, model):
+        pass
+
+    @abstractmethod
+    def staged(self, name):
+        pass
+
+    @abstractmethod
+    def drop(self, name):
+        pass
+
+    @abstractmethod
+    def query_watermark(self, table, keys):
+        pass
+
+
+class BigQuerySink(Sink):
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.partitioned = set()
+        self.lock = threading.Lock()
+
+    def submit(self, model, batch):
+        from google.cloud import bigquery
+
+        if model.update_mode != "merge":
+            self._repartition(model, model.stage)
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as f:
+            with timer("serialize"):
+                if model.load_format == "parquet":
+                    write_parquet(batch, model.schema, f)
+                    source_format = "PARQUET"
+                else:
+                    for row in batch.records():
+                        f.write(json.dumps(row).encode("utf-8"))
+                        f.write(b"\n")
+                    source_format = "NEWLINE_DELIMITED_JSON"
+            count("bytes_uploaded", f.tell())
+            count("load_jobs")
+            f.seek(0)
+            with timer("load"):
+                return get_client().load_table_from_file(
+                    f,
+                    f"{self.dataset}.{model.stage}",
+                    job_config=bigquery.LoadJobConfig(
+                        source_format=source_format,
+                        create_disposition="CREATE_IF_NEEDED",
+                        write_disposition="WRITE_APPEND",
+                        schema=model.schema,
+                        time_partitioning=bigquery.TimePartitioning(
+                            type_="DAY",
+                            field=model.keys["partition_key"],
+                        ),
+                        clustering_fields=model.keys["cluster_key"],
+                    ),
+                )
+
+    def wait(self, jobs):
+        return sum(job.result().output_rows for job in jobs)
+
+    def replace(self, model):
+        self._repartition(model, model.table)
+        query = f"""
+        CREATE OR REPLACE TABLE `{self.dataset}`.`{model.table}`
+        PARTITION BY DATE({model.keys['partition_key']})
+        CLUSTER BY {','.join(model.keys['cluster_key'])}
+        AS
+        SELECT * EXCEPT (row_num) FROM
+        (
+            SELECT
+                *,
+                ROW_NUMBER() over (
+                    PARTITION BY {','.join(model.keys['p_key'])}
+                    ORDER BY {model.keys['incre_key']} DESC
+                    ) AS row_num
+                FROM
+                    `{self.dataset}`.`{model.stage}`
+            )
+        WHERE
+            row_num = 1
+        """
+        run_query(query)
+
+    def merge(self, model):
+        p_key = model.keys["p_key"]
+        incre_key = model.keys["incre_key"]
+        partition_key = model.keys["partition_key"]
+        columns = [i["name"] for i in model.schema]
+        self._repartition(model, model.table)
+        query = f"""
+        DECLARE partitions STRUCT<lo TIMESTAMP, hi TIMESTAMP> DEFAULT (
+            SELECT AS STRUCT
+                MIN({partition_key}) AS lo,
+                MAX({partition_key}) AS hi
+            FROM `{self.dataset}`.`{model.stage}`
+        );
+
+        CREATE TABLE IF NOT EXISTS `{self.dataset}`.`{model.table}`
+        LIKE `{self.dataset}`.`{model.stage}`;
+
+        MERGE `{self.dataset}`.`{model.table}` T
+        USING (
+            SELECT * EXCEPT (row_num) FROM
+            (
+                SELECT
+                    *,
+                    ROW_NUMBER() over (
+                        PARTITION BY {','.join(p_key)}
+                        ORDER BY {incre_key} DESC
+                        ) AS row_num
+                    FROM
+                        `{self.dataset}`.`{model.stage}`
+                )
+            WHERE
+                row_num = 1
+        ) S
+        ON {' AND '.join(f'T.{i} IS NOT DISTINCT FROM S.{i}' for i in p_key)}
+        AND T.{partition_key} BETWEEN partitions.lo AND partitions.hi
+        WHEN MATCHED AND (T.{incre_key} IS NULL OR S.{incre_key} >= T.{incre_key})
+        THEN UPDATE SET {', '.join(f'{i} = S.{i}' for i in columns)}
+        WHEN NOT MATCHED
+        THEN INSERT ({', '.join(columns)}) VALUES ({', '.join(f'S.{i}' for i in columns)})
+        """
+        run_query(query)
+
+    def _repartition(self, model, name):
+        """Partition a table created before partitioning, once per table.
+
+        BigQuery refuses CREATE OR REPLACE and partitioned load jobs on a
+        table with another partitioning spec, so the rows are copied into a
+        new partitioned table that then takes the old one's place.
+        """
+        from google.api_core.exceptions import NotFound
+
+        with self.lock:
+            if name in self.partitioned:
+                return
+            partition_key = model.keys["partition_key"]
+            repartitioned = f"{name}_repartitioned"
+            try:
+                table = get_client().get_table(f"{self.dataset}.{name}")
+            except NotFound:
+                table = None
+            if table is None:
+                if self.staged(repartitioned):
+                    query = f"""
+                    ALTER TABLE `{self.dataset}`.`{repartitioned}`
+                    RENAME TO `{name}`
+                    """
+                    run_query(query)
+            elif (
+                table.time_partitioning is None
+                or table.time_partitioning.field != partition_key
+            ):
+                log("repartition", table=name)
+                query = f"""
+                CREATE OR REPLACE TABLE `{self.dataset}`.`{repartitioned}`
+                PARTITION BY DATE({partition_key})
+                CLUSTER BY {','.join(model.keys['cluster_key'])}
+                AS SELECT * FROM `{self.dataset}`.`{name}`;
+
+                DROP TABLE `{self.dataset}`.`{name}`;
+
+                ALTER TABLE `{self.dataset}`.`{repartitioned}`
+                RENAME TO `{name}`;
+                """
+                run_query(query)
+            self.partitioned.add(name)
+
+    def rollup(self, model):
+        partition_key = model.keys["partition_key"]
+        if model.partitions:
+            lo, hi = (
+                x.astimezone(timezone.utc).isoformat(sep=" ") for x in model.partitions
+            )
+            query = f"""
+        DECLARE partitions STRUCT<lo TIMESTAMP, hi TIMESTAMP> DEFAULT STRUCT(
+            TIMESTAMP '{lo}' AS lo,
+            TIMESTAMP '{hi}' AS hi
+        );
+        """
+        else:
+            query = f"""
+        DECLARE partitions STRUCT<lo TIMESTAMP, hi TIMESTAMP> DEFAULT (
+            SELECT AS STRUCT
+                MIN({partition_key}) AS lo,
+                MAX({partition_key}) AS hi
+            FROM `{self.dataset}`.`{model.stage}`
+        );
+        """
+        for rollup in model.rollups:
+            table = f"{model.table}_{rollup.suffix}"
+            lo = f"TIMESTAMP_TRUNC(partitions.lo, {rollup.grain}, '{TZ}')"
+            hi = f"TIMESTAMP_TRUNC(partitions.hi, {rollup.grain}, '{TZ}')"
+            bucket = f"TIMESTAMP_TRUNC({partition_key}, {rollup.grain}, '{TZ}')"
+            span = ROLLUP_SPANS[rollup.column]
+            where = (
+                f"{partition_key} >= {lo} "
+                f"AND {partition_key} < TIMESTAMP_ADD({hi}, INTERVAL {span} DAY) "
+                f"AND {bucket} BETWEEN {lo} AND {hi}"
+            )
+            columns = [rollup.column, *rollup.dimensions, *rollup.metrics]
+            query += f"""
+        CREATE TABLE IF NOT EXISTS `{self.dataset}`.`{table}`
+        PARTITION BY DATE({rollup.column})
+        CLUSTER BY {','.join(rollup.dimensions)}
+        AS {self._aggregate(model, rollup, bucket, "FALSE")};
+
+        BEGIN TRANSACTION;
+
+        DELETE FROM `{self.dataset}`.`{table}`
+        WHERE {rollup.column} BETWEEN {lo} AND {hi};
+
+        INSERT INTO `{self.dataset}`.`{table}` ({', '.join(columns)})
+        {self._aggregate(model, rollup, bucket, where)};
+
+        COMMIT TRANSACTION;
+        """
+        run_query(query)
+
+    def _aggregate(self, model, rollup, bucket, where):
+        return f"""
+        SELECT
+            {bucket} AS {rollup.column},
+            {', '.join(rollup.dimensions)},
+            {', '.join(f'{v} AS {k}' for k, v in rollup.metrics.items())}
+        FROM `{self.dataset}`.`{model.table}`
+        WHERE {where}
+        GROUP BY {', '.join(str(i + 1) for i in range(len(rollup.dimensions) + 1))}
+        """
+
+    def staged(self, name):
+        from google.api_core.exceptions import NotFound
+
+        try:
+            get_client().get_table(f"{self.dataset}.{name}")
+            return True
+        except NotFound:
+            return False
+
+    def drop(self, name):
+        get_client().delete_table(f"{self.dataset}.{name}", not_found_ok=True)
+
+    def query_watermark(self, table, keys):
+        from google.api_core.exceptions import NotFound
+
+        query = f"""
+        SELECT MAX({keys['incre_key']}) AS incre
+        FROM `{self.dataset}`.`{table}`
+        WHERE {keys['partition_key']} >= TIMESTAMP_SUB(
+            CURRENT_TIMESTAMP(), INTERVAL {WATERMARK_LOOKBACK} DAY
+        )
+        """
+        try:
+            incre = [dict(row) for row in run_query(query)][0]["incre"]
+        except NotFound:
+            return None
+        if incre:
+            return incre
+        query = f"""
+        SELECT MAX({keys['incre_key']}) AS incre
+        FROM `{self.dataset}`.`{table}`
+        """
+        return [dict(row) for row in run_query(query)][0]["incre"]
+
+
+class LocalSink(Sink):
+    def __init__(self, path):
+        self.path = path
+
+    def _files(self, name):
+        files = []
+        for root, _, names in os.walk(os.path.join(self.path, name)):
+            files.extend(os.path.join(root, i) for i in names if i.endswith(".parquet"))
+        return sorted(files)
+
+    def _read(self, files, schema):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        tables = [pq.read_table(f) for f in files]
+        if not tables:
+            return pa.table(
+                [to_arrow([], field["type"]) for field in schema],
+                names=[field["name"] for field in schema],
+            )
+        return pa.concat_tables(tables)
+
+    def _write(self, table, path):
+        import pyarrow.parquet as pq
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pq.write_table(table, f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
+    def _partitions(self, model, table):
+        dates = defaultdict(list)
+        values = table.column(model.keys["partition_key"]).to_pylist()
+        for i, value in enumerate(values):
+            dates[value.date().isoformat() if value else "__NULL__"].append(i)
+        for date, indices in dates.items():
+            yield (
+                os.path.join(self.path, model.table, date, "data.parquet"),
+                table.take(indices),
+            )
+
+    def submit(self, model, batch):
+        path = os.path.join(self.path, model.stage, f"{uuid.uuid4().hex}.parquet")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with timer("serialize"):
+            with open(f"{path}.tmp", "wb") as f:
+                write_parquet(batch, model.schema, f)
+            os.replace(f"{path}.tmp", path)
+        count("bytes_written", os.path.getsize(path))
+        return len(batch)
+
+    def wait(self, jobs):
+        return sum(jobs)
+
+    def merge(self, model):
+        import pyarrow as pa
+
+        stage = self._read(self._files(model.stage), model.schema)
+        for path, rows in self._partitions(model, stage):
+            existing = self._read([path] if os.path.exists(path) else [], model.schema)
+            self._write(
+                dedup_table(
+                    pa.concat_tables([rows, existing]),
+                    model.keys["p_key"],
+                    model.keys["incre_key"],
+                ),
+                path,
+            )
+
+    def replace(self, model):
+        stage = dedup_table(
+            self._read(self._files(model.stage), model.schema),
+            model.keys["p_key"],
+            model.keys["incre_key"],
+        )
+        self.drop(model.table)
+        for path, rows in self._partitions(model, stage):
+            self._write(rows, path)
+
+    def staged(self, name):
+        return bool(self._files(name))
+
+    def drop(self, name):
+        shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    def query_watermark(self, table, keys):
+        import pyarrow.parquet as pq
+
+        values = [
+            value
+            for f in self._files(table)
+            for value in pq.read_table(f, columns=[keys["incre_key"]])
+            .column(0)
+            .to_pylist()
+            if value
+        ]
+        return max(values) if values else None
+
+
+def get_sink(sink):
+    if sink == "bigquery":
+        return BigQuerySink(DATASET)
+    elif sink == "local":
+        return LocalSink(SINK_PATH)
+    else:
+        raise ValueError(sink)
+
+
+SINK = get_sink(SINK_TYPE)
@@ -0,0 +1,32 @@
+from datetime import datetime
+from functools import lru_cache
+
+import pytz
+
+VOLUUM_FORMAT = "%Y-%m-%d %I:%M:%S %p"
+
+
+@lru_cache(maxsize=None)
+def get_tz(tz):
+    return pytz.timezone(tz)
+
+
+@lru_cache(maxsize=2 ** 16)
+def parse_timestamp(x, tz):
+    if len(x) == 22:
+        dt = datetime(
+            int(x[0:4]),
+            int(x[5:7]),
+            int(x[8:10]),
+            int(x[11:13]) % 12 + (12 if x[20] in "Pp" else 0),
+            int(x[14:16]),
+            int(x[17:19]),
+        )
+    else:
+        dt = datetime.strptime(x, VOLUUM_FORMAT)
+    return get_tz(tz).localize(dt).isoformat(timespec="seconds")
+
+
+def to_datetime(x):
+    dt = datetime.fromisoformat(x.replace("Z", "+00:00"))
+    return dt if dt.tzinfo else pytz.utc.localize(dt)
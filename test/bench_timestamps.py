@@ -0,0 +1,44 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from models.timestamps import VOLUUM_FORMAT, parse_timestamp
+
+TZ = "America/Los_Angeles"
+
+
+def parse_timestamp_strptime(x, tz):
+    dt = datetime.strptime(x, VOLUUM_FORMAT)
+    return pytz.timezone(tz).localize(dt).isoformat(timespec="seconds")
+
+
+def generate(n, days=1):
+    start = datetime(2021, 9, 25)
+    return [
+        (start + timedelta(seconds=random.randrange(days * 86400))).strftime(
+            VOLUUM_FORMAT
+        )
+        for _ in range(n)
+    ]
+
+
+def bench(fn, values):
+    started_at = time.perf_counter()
+    for x in values:
+        fn(x, TZ)
+    return len(values) / (time.perf_counter() - started_at)
+
+
+if __name__ == "__main__":
+    values = generate(200000)
+    assert [parse_timestamp(x, TZ) for x in values[:1000]] == [
+        parse_timestamp_strptime(x, TZ) for x in values[:1000]
+    ]
+    parse_timestamp.cache_clear()
+    for name, fn in [
+        ("strptime", parse_timestamp_strptime),
+        ("parse_timestamp", parse_timestamp),
+    ]:
+        print(f"{name}: {bench(fn, values):,.0f} rows/s")
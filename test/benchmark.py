@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import time
+import math
+import argparse
+import tempfile
+import resource
+import subprocess
+from datetime import datetime, timedelta
+
+
+TABLES = ["Report", "ReportConversions", "ReportConversions2", "Offer"]
+REPORT_DAYS = 29
+
+
+def run_case(table, rows, latency, throttle_every, load_latency=0):
+    from test.fakes import FakeBigQueryClient, serve_in_process
+
+    end = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    start = end - timedelta(days=1)
+    fake = {
+        "start": start,
+        "end": end,
+        "latency": latency,
+        "throttle_every": throttle_every,
+    }
+    if table == "Report":
+        fake["report_rows"] = math.ceil(rows / REPORT_DAYS)
+        expected = fake["report_rows"] * REPORT_DAYS
+    elif table == "Offer":
+        fake["offers"] = expected = rows
+    else:
+        fake["conversions"] = expected = rows
+
+    with serve_in_process(**fake) as url, tempfile.TemporaryDirectory() as path:
+        os.environ.update(
+            {
+                "VOLUUM_BASE_URL": url,
+                "CHECKPOINT_STORE": "memory",
+                "CACHE_PATH": os.path.join(path, "cache"),
+                "SINK_PATH": os.path.join(path, "sink"),
+                "RATE_LIMIT": "1000",
+                "RATE_BURST": "1000",
+            }
+        )
+        from models import client
+        from models.models import Voluum
+
+        client.BQ_CLIENT = FakeBigQueryClient(load_latency)
+        started_at = time.perf_counter()
+        response = Voluum.factory(table, None, None).run()
+        elapsed = time.perf_counter() - started_at
+
+    return {
+        "table": table,
+        "rows": expected,
+        "num_processed": response["num_processed"],
+        "output_rows": response["output_rows"],
+        "elapsed": round(elapsed, 3),
+        "rows_per_second": round(response["num_processed"] / elapsed),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024),
+        "timings": response["metrics"]["timings"],
+        "counters": response["metrics"]["counters"],
+    }
+
+
+def run(table, rows, latency, throttle_every, load_latency=0):
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "test.benchmark",
+            "--case",
+            table,
+            str(rows),
+            "--latency",
+            str(latency),
+            "--throttle-every",
+            str(throttle_every),
+            "--load-latency",
+            str(load_latency),
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return json.loads(output.stdout.splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tables", nargs="+", default=TABLES)
+    parser.add_argument("--rows", nargs="+", type=int, default=[10000, 100000, 1000000])
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--throttle-every", type=int, default=0)
+    parser.add_argument("--load-latency", type=float, default=0)
+    parser.add_argument("--sink", choices=["bigquery", "local"])
+    parser.add_argument("--min-throughput", type=float, default=0)
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--case", nargs=2)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        table, rows = args.case
+        result = run_case(
+            table,
+            int(rows),
+            args.latency,
+            args.throttle_every,
+            args.load_latency,
+        )
+        print(json.dumps(result))
+        return 0
+
+    if args.sink:
+        os.environ["SINK_TYPE"] = args.sink
+
+    failed = False
+    for table in args.tables:
+        for rows in args.rows:
+            result = run(
+                table,
+                rows,
+                args.latency,
+                args.throttle_every,
+                args.load_latency,
+            )
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print(
+                    f"{result['table']:<20} {result['rows']:>9,} rows "
+                    f"{result['elapsed']:>8.2f}s "
+                    f"{result['rows_per_second']:>9,} rows/s "
+                    f"{result['peak_rss_mb']:>6,} MB  "
+                    + " ".join(f"{k}={v}" for k, v in result["timings"].items())
+                )
+            if not result["num_processed"] == result["output_rows"] == result["rows"]:
+                print(f"{table}: expected {result['rows']} rows", file=sys.stderr)
+                failed = True
+            if result["rows_per_second"] < args.min_throughput:
+                print(f"{table}: below {args.min_throughput} rows/s", file=sys.stderr)
+                failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,26 @@
+import pytest
+
+import models.Report
+from models import api, checkpoints, client, models as pipeline
+from models.cache import NullResponseCache
+from models.settings import DATASET
+from models.sinks import BigQuerySink
+from test.fakes import FakeVoluum, FakeBigQueryClient
+
+REPORT_ROWS = 20
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    store = checkpoints.MemoryCheckpointStore()
+    with FakeVoluum(report_rows=REPORT_ROWS) as fake:
+        monkeypatch.setattr(api, "BASE_URL", fake.url)
+        monkeypatch.setattr(models.Report, "BASE_URL", fake.url)
+        monkeypatch.setattr(models.Report, "RESPONSE_CACHE", NullResponseCache())
+        monkeypatch.setattr(api, "TOKENS", api.TokenCache())
+        monkeypatch.setattr(api, "RATE_LIMITER", api.RateLimiter(1000, 1000))
+        monkeypatch.setattr(checkpoints, "CHECKPOINTS", store)
+        monkeypatch.setattr(pipeline, "CHECKPOINTS", store)
+        monkeypatch.setattr(client, "BQ_CLIENT", FakeBigQueryClient())
+        monkeypatch.setattr(pipeline, "SINK", BigQuerySink(DATASET))
+        yield fake
@@ -0,0 +1,334 @@
+import io
+import re
+import json
+import math
+import time
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from google.api_core.exceptions import BadRequest, NotFound
+
+VOLUUM_FORMAT = "%Y-%m-%d %I:%M:%S %p"
+
+
+class FakeVoluum:
+    def __init__(
+        self,
+        report_rows=0,
+        conversions=0,
+        offers=0,
+        start=None,
+        end=None,
+        latency=0,
+        throttle_every=0,
+        retry_after="0",
+    ):
+        self.report_rows = report_rows
+        self.conversions = conversions
+        self.offers = offers
+        self.end = end or datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        self.start = start or self.end - timedelta(days=1)
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _index(self, x):
+        seconds = (self.end - self.start).total_seconds()
+        i = (x - self.start).total_seconds() / seconds * self.conversions
+        return min(max(math.ceil(i), 0), self.conversions)
+
+    def conversion(self, i):
+        ts = self.start + timedelta(
+            seconds=int(i * (self.end - self.start).total_seconds() / self.conversions)
+        )
+        return {
+            "postbackTimestamp": ts.strftime(VOLUUM_FORMAT),
+            "visitTimestamp": (ts - timedelta(minutes=5)).strftime(VOLUUM_FORMAT),
+            "clickId": f"click{i}",
+            "conversionType": "LEAD" if i % 3 else "VIEW",
+            "offerName": f"Offer {i % 50}",
+            "offerId": f"offer{i % 50}",
+            "countryCode": ["US", "GB", "DE", "FR"][i % 4],
+            "countryName": ["United States", "United Kingdom", "Germany", "France"][
+                i % 4
+            ],
+            "trafficSourceName": f"Source {i % 5}",
+            "trafficSourceId": f"source{i % 5}",
+            "transactionId": f"tx{i}",
+            "ip": f"10.0.{i // 256 % 256}.{i % 256}",
+            "campaignName": f"Campaign {i % 200}",
+            "campaignId": f"campaign{i % 200}",
+            "creativeId": f"creative{i % 20}",
+            **{f"customVariable{j}": f"var{j}-{i % 97}" for j in range(1, 8)},
+            "deviceName": "Mobile" if i % 2 else "Desktop",
+            "os": "Android" if i % 2 else "Windows",
+            "osVersion": str(i % 12),
+            "browser": "Chrome",
+        }
+
+    def report_row(self, i, day):
+        return {
+            "day": day,
+            "campaignId": f"campaign{i}",
+            "campaignName": f"Campaign {i}",
+            "impressions": i * 10,
+            "visits": i * 5,
+            "uniqueVisits": i * 4,
+            "clicks": i * 3,
+            "conversions": i,
+            "customConversions1": i // 2,
+            "customConversions5": i // 3,
+            "revenue": i * 1.5,
+            "cost": i * 1.0,
+            "profit": i * 0.5,
+            "deleted": False,
+        }
+
+    def offer(self, i):
+        return {
+            "id": f"offer{i}",
+            "name": f"Offer {i}",
+            "namePostfix": "",
+            "createdTime": "2021-01-01T00:00:00.000Z",
+            "updatedTime": (datetime(2021, 1, 1) + timedelta(minutes=i)).isoformat()
+            + ".000Z",
+            "deleted": False,
+            "url": f"https://example.com/{i}",
+            "currencyCode": "USD",
+        }
+
+    def handle(self, method, path, query):
+        if method == "POST" and path == "/auth/session":
+            return {
+                "token": "token",
+                "expirationTimestamp": (
+                    datetime.utcnow() + timedelta(hours=4)
+                ).isoformat(timespec="milliseconds")
+                + "Z",
+            }
+        limit = int(query.get("limit", [10000])[0])
+        offset = int(query.get("offset", [0])[0])
+        if path == "/report/conversions":
+            lo, hi = [
+                self._index(datetime.strptime(query[i][0], "%Y-%m-%dT%H"))
+                for i in ("from", "to")
+            ]
+            start, stop = lo + offset, min(lo + offset + limit, hi)
+            return {
+                "totalRows": hi - lo,
+                "rows": [self.conversion(i) for i in range(start, stop)],
+            }
+        elif path == "/report":
+            day = query["from"][0][:10]
+            stop = min(offset + limit, self.report_rows)
+            return {
+                "totalRows": self.report_rows,
+                "rows": [self.report_row(i, day) for i in range(offset, stop)],
+            }
+        elif path == "/offer":
+            return {"offers": [self.offer(i) for i in range(self.offers)]}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _respond(self, method):
+                url = urlparse(self.path)
+                with fake.lock:
+                    fake.requests += 1
+                    throttled = (
+                        fake.throttle_every and fake.requests % fake.throttle_every == 0
+                    )
+                if self.headers.get("Content-Length"):
+                    self.rfile.read(int(self.headers["Content-Length"]))
+                time.sleep(fake.latency)
+                if throttled:
+                    self.send_response(429)
+                    self.send_header("Retry-After", fake.retry_after)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                res = fake.handle(method, url.path, parse_qs(url.query))
+                body = json.dumps(res).encode("utf-8") if res is not None else b""
+                self.send_response(200 if res is not None else 404)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST")
+
+        return Handler
+
+
+def _serve(kwargs, urls):
+    with FakeVoluum(**kwargs) as fake:
+        urls.put(fake.url)
+        fake.thread.join()
+
+
+@contextmanager
+def serve_in_process(**kwargs):
+    """Run a FakeVoluum in a child process and yield its URL.
+
+    Keeps the server's CPU time and memory out of the pipeline's numbers.
+    """
+    context = multiprocessing.get_context("spawn")
+    urls = context.Queue()
+    process = context.Process(target=_serve, args=(kwargs, urls), daemon=True)
+    process.start()
+    try:
+        yield urls.get(timeout=60)
+    finally:
+        process.terminate()
+        process.join()
+
+
+class FakeJob:
+    def __init__(self, rows=None, output_rows=0, latency=0):
+        self.rows = rows or []
+        self.output_rows = output_rows
+        self.total_bytes_processed = 0
+        self.slot_millis = 0
+        self.done_at = time.monotonic() + latency
+
+    def result(self):
+        time.sleep(max(self.done_at - time.monotonic(), 0))
+        return self
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class FakeBigQueryClient:
+    def __init__(self, load_latency=0):
+        self.load_latency = load_latency
+        self.tables = {}
+        self.queries = []
+        self.checkpoints = {}
+        self.partitioning = {}
+        self.lock = threading.Lock()
+
+    def load_table_from_file(self, f, destination, job_config=None):
+        data = f.read()
+        if job_config.source_format == "PARQUET":
+            import pyarrow.parquet as pq
+
+            rows = pq.read_metadata(io.BytesIO(data)).num_rows
+        else:
+            rows = data.count(b"\n")
+        with self.lock:
+            if destination in self.tables:
+                self._check_partitioning(
+                    destination, job_config.time_partitioning.field
+                )
+            self.tables[destination] = self.tables.get(destination, 0) + rows
+            self.partitioning[destination] = job_config.time_partitioning
+        return FakeJob(output_rows=rows, latency=self.load_latency)
+
+    def query(self, query, job_config=None):
+        params = {
+            param.name: param.value
+            for param in (job_config.query_parameters if job_config else [])
+        }
+        with self.lock:
+            self.queries.append(query)
+            for statement in query.split(";"):
+                self._execute_ddl(statement)
+            if "AS incre" in query:
+                return FakeJob([{"incre": None}])
+            if query.lstrip().startswith("MERGE") and "key" in params:
+                self.checkpoints[params["key"]] = params["value"]
+            elif query.lstrip().startswith("SELECT value") and "key" in params:
+                if params["key"] in self.checkpoints:
+                    return FakeJob([{"value": self.checkpoints[params["key"]]}])
+            elif query.lstrip().startswith("DELETE") and "key" in params:
+                self.checkpoints.pop(params["key"], None)
+        return FakeJob()
+
+    def _check_partitioning(self, table, field):
+        partitioning = self.partitioning.get(table)
+        if (partitioning.field if partitioning else None) != field:
+            raise BadRequest(
+                f"Cannot replace a table with a different partitioning spec: {table}"
+            )
+
+    def _execute_ddl(self, statement):
+        created = re.search(
+            r"CREATE (OR REPLACE )?TABLE (IF NOT EXISTS )?`(\w+)`.`(\w+)`"
+            r"\s+PARTITION BY DATE\((\w+)\)",
+            statement,
+        )
+        dropped = re.search(r"DROP TABLE `(\w+)`.`(\w+)`", statement)
+        renamed = re.search(
+            r"ALTER TABLE `(\w+)`.`(\w+)`\s+RENAME TO `(\w+)`", statement
+        )
+        if created:
+            replace, if_not_exists, dataset, table, field = created.groups()
+            table = f"{dataset}.{table}"
+            if table in self.tables:
+                if if_not_exists:
+                    return
+                if not replace:
+                    raise BadRequest(f"Already exists: {table}")
+                self._check_partitioning(table, field)
+            source = re.search(r"AS SELECT \* FROM `(\w+)`.`(\w+)`", statement)
+            self.tables[table] = (
+                self.tables.get(".".join(source.groups()), 0) if source else 0
+            )
+            self.partitioning[table] = SimpleNamespace(field=field)
+        elif dropped:
+            table = ".".join(dropped.groups())
+            if table not in self.tables:
+                raise NotFound(table)
+            self.tables.pop(table)
+            self.partitioning.pop(table, None)
+        elif renamed:
+            dataset, table, name = renamed.groups()
+            if f"{dataset}.{name}" in self.tables:
+                raise BadRequest(f"Already exists: {dataset}.{name}")
+            self.tables[f"{dataset}.{name}"] = self.tables.pop(f"{dataset}.{table}")
+            self.partitioning[f"{dataset}.{name}"] = self.partitioning.pop(
+                f"{dataset}.{table}", None
+            )
+
+    def get_table(self, table):
+        if table not in self.tables:
+            raise NotFound(table)
+        return SimpleNamespace(
+            table_id=table,
+            time_partitioning=self.partitioning.get(table),
+        )
+
+    def delete_table(self, table, not_found_ok=False):
+        with self.lock:
+            self.tables.pop(table, None)
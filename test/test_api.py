@@ -0,0 +1,153 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from models import api
+
+
+def make_get_json(total, page_size, report_total=True):
+    calls = []
+
+    def get_json(session, url, params):
+        calls.append(params["offset"])
+        stop = min(params["offset"] + min(params["limit"], page_size), total)
+        res = {"rows": list(range(params["offset"], stop))}
+        if report_total:
+            res["totalRows"] = total
+        return res
+
+    return get_json, calls
+
+
+@pytest.mark.parametrize("report_total", [True, False])
+def test_paginate_short_pages(monkeypatch, report_total):
+    get_json, calls = make_get_json(25, 10, report_total)
+    monkeypatch.setattr(api, "get_json", get_json)
+    pages = list(api.paginate(None, "url", {}, limit=100))
+    assert [row for rows in pages for row in rows] == list(range(25))
+    assert calls == ([0, 10, 20] if report_total else [0, 10, 20, 25])
+
+
+def test_paginate_empty(monkeypatch):
+    get_json, calls = make_get_json(0, 10)
+    monkeypatch.setattr(api, "get_json", get_json)
+    assert list(api.paginate(None, "url", {})) == []
+    assert calls == [0]
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = b""
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+
+    def request(self, method, url, **kwargs):
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(
+        api,
+        "time",
+        SimpleNamespace(sleep=sleeps.append, monotonic=time.monotonic, time=time.time),
+    )
+    monkeypatch.setattr(api, "RATE_LIMITER", api.RateLimiter(1000, 1000))
+    monkeypatch.setattr(
+        api, "CIRCUIT_BREAKER", api.CircuitBreaker(api.CIRCUIT_THRESHOLD, 60)
+    )
+    return sleeps
+
+
+@pytest.mark.parametrize(
+    ("retry_after", "expected"),
+    [
+        ("3", 3),
+        ("-1", 0),
+        ("3600", api.HTTP_BACKOFF_MAX),
+        ("Thu, 01 Jan 1970 00:00:00 GMT", 0),
+    ],
+)
+def test_backoff_retry_after(retry_after, expected):
+    r = FakeResponse(429, {"Retry-After": retry_after})
+    assert api.get_backoff(0, r) == expected
+
+
+@pytest.mark.parametrize("retry_after", ["soon", "Thu, 99 Foo 2021"])
+def test_backoff_unparseable_retry_after(retry_after):
+    r = FakeResponse(429, {"Retry-After": retry_after})
+    for attempt in range(10):
+        assert 0 <= api.get_backoff(attempt, r) <= api.HTTP_BACKOFF_MAX
+    assert api.get_backoff(0, r) <= api.HTTP_BACKOFF
+
+
+def test_request_retries(sleeps):
+    session = FakeSession(
+        [
+            FakeResponse(429, {"Retry-After": "2"}),
+            FakeResponse(503, {"Retry-After": "1"}),
+            FakeResponse(200),
+        ]
+    )
+    assert api.request(session, "GET", "url").status_code == 200
+    assert sleeps == [2, 1]
+
+
+def test_request_gives_up(sleeps):
+    session = FakeSession([FakeResponse(500)] * (api.HTTP_RETRIES + 1))
+    assert api.request(session, "GET", "url").status_code == 500
+    assert len(sleeps) == api.HTTP_RETRIES
+
+
+def test_circuit_breaker_waits_out_cooldown(sleeps):
+    breaker = api.CircuitBreaker(2, 60)
+    breaker.check()
+    breaker.failure()
+    breaker.check()
+    assert sleeps == []
+
+    breaker.failure()
+    breaker.check()
+    assert len(sleeps) == 1 and 59 < sleeps[0] <= 60
+
+    breaker.success()
+    breaker.check()
+    assert len(sleeps) == 1
+
+
+def test_request_honours_http_date_retry_after(sleeps):
+    from test.fakes import FakeVoluum
+
+    with FakeVoluum(throttle_every=1) as fake:
+        fake.retry_after = "Thu, 01 Jan 1970 00:00:00 GMT"
+        r = api.request(api.get_session(), "GET", f"{fake.url}/offer")
+    assert r.status_code == 429
+    assert sleeps == [0] * api.HTTP_RETRIES
+
+
+def test_token_cache(tmp_path):
+    from test.fakes import FakeVoluum
+
+    path = tmp_path / "token.json"
+    path.write_text("{not json")
+    tokens = api.TokenCache(str(path))
+
+    with FakeVoluum() as fake, pytest.MonkeyPatch.context() as m:
+        m.setattr(api, "BASE_URL", fake.url)
+        assert tokens.get(api.get_session()) == "token"
+        assert fake.requests == 1
+
+        assert path.stat().st_mode & 0o777 == 0o600
+        assert [i.name for i in tmp_path.iterdir()] == ["token.json"]
+        assert api.TokenCache(str(path)).get(api.get_session()) == "token"
+        assert fake.requests == 1
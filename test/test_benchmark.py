@@ -0,0 +1,30 @@
+import pytest
+
+from test.benchmark import run
+
+
+@pytest.mark.parametrize(
+    "table",
+    [
+        "ReportConversions",
+        "ReportConversions2",
+        "Report",
+        "Offer",
+    ],
+)
+@pytest.mark.parametrize(
+    ("pipeline_mode", "sink"),
+    [
+        ("overlap", "bigquery"),
+        ("sequential", "bigquery"),
+        ("overlap", "local"),
+    ],
+)
+def test_benchmark(table, pipeline_mode, sink, monkeypatch):
+    monkeypatch.setenv("PIPELINE_MODE", pipeline_mode)
+    monkeypatch.setenv("SINK_TYPE", sink)
+    res = run(table, 2000, 0, 7)
+    assert res["num_processed"] == res["output_rows"] == res["rows"] > 0
+    assert res["timings"]["total"] > 0
+    if table != "Offer" and sink == "bigquery":
+        assert res["timings"]["rollup"] >= 0
@@ -0,0 +1,30 @@
+import os
+
+from models.cache import FileResponseCache, cache_key
+
+
+def test_cache(tmp_path):
+    cache = FileResponseCache(str(tmp_path), 1024 * 1024)
+    key = cache_key({"from": "2021-09-01T00:00:00Z", "column": ["a", "b"]})
+    assert cache.get(key) is None
+    cache.set(key, [{"campaignId": "1", "visits": 2}])
+    assert cache.get(key) == [{"campaignId": "1", "visits": 2}]
+    assert key != cache_key({"from": "2021-09-02T00:00:00Z", "column": ["a", "b"]})
+
+
+def test_cache_corrupt(tmp_path):
+    cache = FileResponseCache(str(tmp_path), 1024 * 1024)
+    with open(os.path.join(tmp_path, "key.json.gz"), "wb") as f:
+        f.write(b"not gzip")
+    assert cache.get("key") is None
+
+
+def test_cache_eviction(tmp_path):
+    rows = [{"campaignId": os.urandom(16).hex()} for _ in range(40)]
+    cache = FileResponseCache(str(tmp_path), 3000)
+    for i in range(5):
+        cache.set(str(i), rows)
+        os.utime(os.path.join(tmp_path, f"{i}.json.gz"), (i, i))
+    assert sum(entry.stat().st_size for entry in os.scandir(tmp_path)) <= 3000
+    assert cache.get("4") == rows
+    assert cache.get("0") is None
@@ -0,0 +1,43 @@
+from models import client
+from models.checkpoints import BigQueryCheckpointStore, FileCheckpointStore
+from test.fakes import FakeBigQueryClient
+
+
+def test_file_store_keys_are_independent(tmp_path):
+    path = str(tmp_path / "checkpoints.json")
+    a = FileCheckpointStore(path, ttl=0)
+    b = FileCheckpointStore(path, ttl=0)
+    a.set("x", 1)
+    b.set("y", 2)
+    assert a.get("y") == 2
+    assert b.get("x") == 1
+    b.delete("x")
+    assert a.get("x") is None
+
+
+def test_file_store_ttl(tmp_path):
+    path = str(tmp_path / "checkpoints.json")
+    writer = FileCheckpointStore(path, ttl=0)
+    cached = FileCheckpointStore(path, ttl=60)
+    fresh = FileCheckpointStore(path, ttl=0)
+    writer.set("x", 1)
+    assert cached.get("x") == fresh.get("x") == 1
+    writer.set("x", 2)
+    assert cached.get("x") == 1
+    assert fresh.get("x") == 2
+
+
+def test_bigquery_store(monkeypatch):
+    fake = FakeBigQueryClient()
+    monkeypatch.setattr(client, "BQ_CLIENT", fake)
+    a = BigQueryCheckpointStore("_checkpoints", ttl=0)
+    b = BigQueryCheckpointStore("_checkpoints", ttl=0)
+    a.set("x", {"v": 1})
+    b.set("y", 2)
+    assert a.get("y") == 2
+    assert b.get("x") == {"v": 1}
+    a.delete("y")
+    assert b.get("y") is None
+    assert not fake.tables
+    assert sum("CREATE TABLE" in query for query in fake.queries) == 2
+    assert sum(query.lstrip().startswith("MERGE") for query in fake.queries) == 2
@@ -0,0 +1,44 @@
+import pytest
+
+from models import api, checkpoints
+from models.Report import Report
+from test.conftest import REPORT_ROWS
+
+CHANGED = 3
+
+
+def change_rows(fake):
+    report_row = fake.report_row
+
+    def changed(i, day):
+        row = report_row(i, day)
+        return {**row, "visits": row["visits"] + 1} if i < CHANGED else row
+
+    fake.report_row = changed
+
+
+def test_dedup_skips_unchanged_rows(fake):
+    first = Report(None, None).run(api.get_session())
+    days = first["num_processed"] // REPORT_ROWS
+    assert first["num_processed"] == days * REPORT_ROWS > 0
+    assert first["num_skipped"] == 0
+
+    change_rows(fake)
+    second = Report(None, None).run(api.get_session())
+    assert second["num_processed"] == days * CHANGED
+    assert second["num_skipped"] == days * (REPORT_ROWS - CHANGED)
+
+
+def test_dedup_forgets_digests_of_failed_run(fake, monkeypatch):
+    first = Report(None, None).run(api.get_session())
+
+    change_rows(fake)
+    with monkeypatch.context() as m:
+        m.setattr(Report, "_update", lambda self: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            Report(None, None).run(api.get_session())
+    assert checkpoints.get_digests("Report") == {}
+
+    third = Report(None, None).run(api.get_session())
+    assert third["num_processed"] == first["num_processed"]
+    assert third["num_skipped"] == 0
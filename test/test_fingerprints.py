@@ -0,0 +1,69 @@
+from array import array
+from datetime import timedelta
+
+import pytz
+
+from models import checkpoints
+from models.settings import NOW, TZ
+from models.ReportConversions import ReportConversions
+from models.timestamps import VOLUUM_FORMAT
+
+
+def make_row(click_id, hours_ago):
+    ts = pytz.utc.localize(NOW - timedelta(hours=hours_ago))
+    return {
+        "clickId": click_id,
+        "postbackTimestamp": ts.astimezone(pytz.timezone(TZ)).strftime(VOLUUM_FORMAT),
+    }
+
+
+def drop_seen(rows):
+    model = ReportConversions(None, None)
+    model.num_skipped = 0
+    model.previous_fingerprints = checkpoints.get_fingerprints(model.table)
+    model.fingerprint_keys = array("Q")
+    model.fingerprint_times = array("Q")
+    kept = [row for _, rows in model._drop_seen([({}, rows)]) for row in rows]
+    model._checkpoint()
+    return model, kept
+
+
+def test_fingerprints(monkeypatch):
+    monkeypatch.setattr(checkpoints, "CHECKPOINTS", checkpoints.MemoryCheckpointStore())
+    checkpoints.CHECKPOINTS.set(
+        "ReportConversions.watermark",
+        pytz.utc.localize(NOW - timedelta(hours=1)).isoformat(),
+    )
+    rows = [make_row(str(i), 0.5) for i in range(100)] + [make_row("old", 5)]
+
+    model, kept = drop_seen(rows)
+    assert kept == rows
+    assert len(checkpoints.get_fingerprints(model.table)) == 100
+
+    model, kept = drop_seen(rows + [make_row("new", 0.1)])
+    assert [row["clickId"] for row in kept] == ["old", "new"]
+    assert model.num_skipped == 100
+    assert len(checkpoints.get_fingerprints(model.table)) == 101
+
+
+def test_fingerprints_merge():
+    fingerprints = checkpoints.Fingerprints([3, 1], [30, 10])
+    assert 1 in fingerprints and 3 in fingerprints and 2 not in fingerprints
+    merged = fingerprints.merge([2, 3], [20, 40], 15, 2)
+    assert list(merged.keys) == [2, 3]
+    assert list(merged.times) == [20, 40]
+
+
+def test_fingerprints_truncated_to_fit(monkeypatch, capsys):
+    monkeypatch.setattr(checkpoints, "CHECKPOINTS", checkpoints.MemoryCheckpointStore())
+    monkeypatch.setattr(checkpoints, "CHECKPOINT_MAX_SIZE", 2560)
+    fingerprints = checkpoints.Fingerprints(range(150), range(1000, 1150))
+
+    checkpoints.set_fingerprints("ReportConversions", fingerprints)
+
+    stored = checkpoints.get_fingerprints("ReportConversions")
+    assert list(stored.keys) == list(range(30, 150))
+    assert len(checkpoints.CHECKPOINTS.get("ReportConversions.fingerprints")) <= (
+        checkpoints.CHECKPOINT_MAX_SIZE
+    )
+    assert "fingerprints_truncated" in capsys.readouterr().out
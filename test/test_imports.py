@@ -0,0 +1,48 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+IMPORT_BUDGET = float(os.getenv("IMPORT_BUDGET", 0.5))
+DEFERRED = ("google.cloud.bigquery", "google.api_core", "pyarrow")
+
+
+@pytest.mark.parametrize(
+    "table",
+    [
+        "ReportConversions",
+        "ReportConversions2",
+        "Report",
+        "Offer",
+    ],
+)
+def test_import(table):
+    env = {k: v for k, v in os.environ.items() if k != "GOOGLE_APPLICATION_CREDENTIALS"}
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, json, time\n"
+            "started_at = time.perf_counter()\n"
+            "import main\n"
+            f"import models.{table}\n"
+            "print(json.dumps({'elapsed': time.perf_counter() - started_at, "
+            "'modules': list(sys.modules)}))",
+        ],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    res = json.loads(output.stdout.splitlines()[-1])
+    assert res["elapsed"] < IMPORT_BUDGET
+    assert not [m for m in res["modules"] if m.startswith(DEFERRED)]
+
+
+def test_factory_unknown_table():
+    from models.models import Voluum
+
+    with pytest.raises(ValueError):
+        Voluum.factory("os", None, None)
@@ -0,0 +1,126 @@
+import time
+
+import pytest
+import pytz
+
+from models.models import Voluum, Field
+
+
+def test_keys_in_schema():
+    with pytest.raises(ValueError, match="countryName"):
+
+        class Bad(Voluum):
+            keys = {
+                "p_key": ["id", "countryName"],
+                "incre_key": "updatedTime",
+                "partition_key": "createdTime",
+                "cluster_key": ["id"],
+            }
+            fields = [
+                Field("id", "STRING"),
+                Field("createdTime", "TIMESTAMP"),
+                Field("updatedTime", "TIMESTAMP"),
+            ]
+
+
+@pytest.mark.parametrize(
+    "table",
+    [
+        "ReportConversions",
+        "ReportConversions2",
+        "Report",
+        "Offer",
+    ],
+)
+def test_models_valid(table):
+    module = __import__(f"models.{table}", fromlist=[table])
+    model = getattr(module, table)
+    names = {field["name"] for field in model.schema}
+    assert set(model.keys["p_key"]) <= names
+
+
+def test_failed_run_waits_for_loads_before_cleanup(fake, monkeypatch):
+    from models import client
+    from models.Report import Report
+
+    jobs = []
+    load_table_from_file = client.BQ_CLIENT.load_table_from_file
+    client.BQ_CLIENT.load_latency = 0.05
+
+    def submit(*args, **kwargs):
+        jobs.append(load_table_from_file(*args, **kwargs))
+        return jobs[-1]
+
+    def drop(*args, **kwargs):
+        assert all(job.done_at <= time.monotonic() for job in jobs)
+
+    get_window = Report._get_window
+
+    def fail(self, session, window):
+        if window[0].day == self.end.day:
+            raise RuntimeError("fetch failed")
+        return get_window(self, session, window)
+
+    monkeypatch.setattr(client.BQ_CLIENT, "load_table_from_file", submit)
+    monkeypatch.setattr(client.BQ_CLIENT, "delete_table", drop)
+    monkeypatch.setattr(Report, "_get_window", fail)
+    model = Report(None, None)
+    model.batch_size = 20
+    model.pipeline_mode = "overlap"
+    with pytest.raises(RuntimeError):
+        model.run()
+    assert len(jobs) > 1
+
+
+def test_run_tables(fake):
+    from models import models
+
+    with pytest.raises(ValueError):
+        models.run_tables([], None, None)
+
+    response = models.run_tables(["Report", "Report", "Unknown"], None, None)
+    assert [result["table"] for result in response["results"]] == [
+        "Report",
+        "Unknown",
+    ]
+    assert response["results"][0]["num_processed"] > 0
+    assert response["failed"] == ["Unknown"]
+
+
+def test_windowed_models_implement_windows():
+    from models.models import WindowedVoluum
+
+    class Partial(WindowedVoluum):
+        keys = {
+            "p_key": ["id"],
+            "incre_key": "id",
+            "partition_key": "id",
+            "cluster_key": ["id"],
+        }
+        fields = [Field("id", "STRING")]
+
+        def _get_time_range(self, start, end):
+            return start, end
+
+        def _get_windows(self, session, start):
+            return []
+
+    with pytest.raises(TypeError, match="_get_window"):
+        Partial(None, None)
+
+
+def test_first_run_on_empty_local_sink(fake, monkeypatch, tmp_path):
+    import models.ReportConversions as conversions
+    from models import checkpoints, models as pipeline
+    from models.sinks import LocalSink
+
+    sink = LocalSink(str(tmp_path))
+    monkeypatch.setattr(pipeline, "SINK", sink)
+    monkeypatch.setattr(checkpoints, "SINK", sink)
+    monkeypatch.setattr(conversions, "BASE_URL", fake.url)
+    fake.conversions = 100
+
+    model = conversions.ReportConversions(None, None)
+    assert model.start < pytz.utc.localize(fake.start)
+    response = model.run()
+    assert response["num_processed"] == response["output_rows"] == 100
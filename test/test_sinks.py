@@ -0,0 +1,172 @@
+from datetime import timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+import pyarrow.parquet as pq
+from google.api_core.exceptions import BadRequest
+
+from models import client
+from models.models import Batch
+from models.sinks import BigQuerySink, LocalSink
+from models.Report import Report
+from test.fakes import FakeBigQueryClient
+
+
+def make_batch(model, batched_at, rows):
+    batch = Batch(model.names)
+    batch.append(
+        {
+            "date_start": "2021-09-01T00:00:00-07:00",
+            "date_end": "2021-09-02T00:00:00-07:00",
+            "_batched_at": batched_at,
+        },
+        [tuple(row.get(name) for name in model.names) for row in rows],
+    )
+    return batch
+
+
+def read(sink, table):
+    return sorted(
+        (row for f in sink._files(table) for row in pq.read_table(f).to_pylist()),
+        key=lambda row: row["campaignId"],
+    )
+
+
+def test_local_sink_merge(tmp_path):
+    sink = LocalSink(str(tmp_path))
+    model = Report(None, None)
+
+    assert (
+        sink.submit(
+            model,
+            make_batch(
+                model,
+                "2021-09-02T00:00:00",
+                [
+                    {"campaignId": "1", "visits": 1},
+                    {"campaignId": "2", "visits": 2},
+                ],
+            ),
+        )
+        == 2
+    )
+    assert sink.staged(model.stage)
+    sink.merge(model)
+    sink.drop(model.stage)
+    assert not sink.staged(model.stage)
+
+    sink.submit(
+        model,
+        make_batch(
+            model,
+            "2021-09-03T00:00:00",
+            [
+                {"campaignId": "1", "visits": 3},
+                {"campaignId": "3", "visits": 4},
+            ],
+        ),
+    )
+    sink.submit(
+        model,
+        make_batch(
+            model,
+            "2021-09-02T12:00:00",
+            [
+                {"campaignId": "1", "visits": 5},
+            ],
+        ),
+    )
+    sink.merge(model)
+
+    rows = read(sink, model.table)
+    assert [(row["campaignId"], row["visits"]) for row in rows] == [
+        ("1", 3),
+        ("2", 2),
+        ("3", 4),
+    ]
+    assert sink.query_watermark(model.table, model.keys).isoformat() == (
+        "2021-09-03T00:00:00+00:00"
+    )
+
+
+def test_local_sink_replace(tmp_path):
+    sink = LocalSink(str(tmp_path))
+    model = Report(None, None)
+    sink.submit(
+        model,
+        make_batch(
+            model,
+            "2021-09-02T00:00:00",
+            [
+                {"campaignId": "1", "visits": 1},
+                {"campaignId": "1", "visits": 2},
+            ],
+        ),
+    )
+    sink.replace(model)
+    assert len(read(sink, model.table)) == 1
+
+
+def test_bigquery_sink_repartitions_once(monkeypatch):
+    fake = FakeBigQueryClient()
+    monkeypatch.setattr(client, "BQ_CLIENT", fake)
+    sink = BigQuerySink("Palma")
+    model = Report(None, None)
+    fake.tables["Palma.Report"] = 10
+    with pytest.raises(BadRequest, match="partitioning spec"):
+        client.run_query(
+            "CREATE OR REPLACE TABLE `Palma`.`Report` PARTITION BY DATE(date_start)"
+        )
+
+    sink.merge(model)
+    sink.merge(model)
+
+    repartitions = [i for i in fake.queries if "RENAME TO" in i]
+    assert len(repartitions) == 1
+    assert fake.tables == {"Palma.Report": 10}
+    assert fake.get_table("Palma.Report").time_partitioning.field == "date_start"
+
+    BigQuerySink("Palma").merge(model)
+    assert len([i for i in fake.queries if "RENAME TO" in i]) == 1
+
+
+def test_bigquery_sink_finishes_interrupted_repartition(monkeypatch):
+    fake = FakeBigQueryClient()
+    monkeypatch.setattr(client, "BQ_CLIENT", fake)
+    fake.tables["Palma.Report_repartitioned"] = 10
+    fake.partitioning["Palma.Report_repartitioned"] = SimpleNamespace(
+        field="date_start"
+    )
+
+    BigQuerySink("Palma").merge(Report(None, None))
+    assert fake.tables == {"Palma.Report": 10}
+
+
+def test_bigquery_sink_replace_repartitions_stage_and_target(fake):
+    bq = client.BQ_CLIENT
+    bq.tables["Palma._stage_Report"] = 10
+    bq.tables["Palma.Report"] = 10
+    model = Report(None, None)
+    model.update_mode = "replace"
+    response = model.run()
+
+    for table in ["Palma._stage_Report", "Palma.Report"]:
+        assert bq.get_table(table).time_partitioning.field == "date_start"
+    assert bq.tables["Palma._stage_Report"] == 10 + response["output_rows"]
+
+
+def test_bigquery_sink_rollup_covers_this_run(fake):
+    model = Report(None, None)
+    model.update_mode = "replace"
+    model.run()
+
+    (query,) = [i for i in client.BQ_CLIENT.queries if "Report_weekly" in i]
+    lo, hi = (x.astimezone(timezone.utc).isoformat(sep=" ") for x in model.partitions)
+    assert f"TIMESTAMP '{lo}' AS lo" in query
+    assert f"TIMESTAMP '{hi}' AS hi" in query
+    assert "_stage_Report" not in query
+    assert model.partitions[1] - model.partitions[0] == timedelta(days=28)
+
+    model.partitions = None
+    BigQuerySink("Palma").rollup(model)
+    assert "FROM `Palma`.`_stage_Report`" in client.BQ_CLIENT.queries[-1]
@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models.timestamps import VOLUUM_FORMAT, parse_timestamp, to_datetime
+
+TZ = "America/Los_Angeles"
+
+
+@pytest.mark.parametrize(
+    ("x", "expected"),
+    [
+        ("2021-09-25 12:00:00 AM", "2021-09-25T00:00:00-07:00"),
+        ("2021-09-25 12:30:15 PM", "2021-09-25T12:30:15-07:00"),
+        ("2021-09-25 01:02:03 AM", "2021-09-25T01:02:03-07:00"),
+        ("2021-09-25 11:59:59 PM", "2021-09-25T23:59:59-07:00"),
+        ("2021-12-25 06:00:00 pm", "2021-12-25T18:00:00-08:00"),
+        ("2021-09-25 1:02:03 PM", "2021-09-25T13:02:03-07:00"),
+        ("2021-9-5 12:00:00 AM", "2021-09-05T00:00:00-07:00"),
+    ],
+)
+def test_parse_timestamp(x, expected):
+    assert parse_timestamp(x, TZ) == expected
+
+
+def test_parse_timestamp_matches_strptime():
+    start = datetime(2021, 9, 25)
+    for minutes in range(0, 24 * 60, 7):
+        x = (start + timedelta(minutes=minutes)).strftime(VOLUUM_FORMAT)
+        dt = datetime.strptime(x, VOLUUM_FORMAT)
+        assert to_datetime(parse_timestamp(x, TZ)).replace(tzinfo=None) == dt
+
+
+def test_parse_timestamp_invalid():
+    with pytest.raises(ValueError):
+        parse_timestamp("2021-09-25T00:00:00", TZ)
@@ -36,6 +36,33 @@ def test_units(table, start, end):
     req = Mock(get_json=Mock(return_value=data), args=data)
     res = main(req)
     assert res["num_processed"] >= 0
+    assert res["metrics"]["timings"]["total"] > 0
     if res["num_processed"] > 0:
         assert res["output_rows"] > 0
         assert res["num_processed"] == res["output_rows"]
+
+
+@pytest.mark.parametrize(
+    "tables",
+    [
+        "all",
+        ["Report", "Offer"],
+    ],
+    ids=(
+        "all",
+        "list",
+    ),
+)
+@pytest.mark.timeout(0)
+def test_tables(tables):
+    data = {
+        "table": tables,
+        "start": None,
+        "end": None,
+    }
+    req = Mock(get_json=Mock(return_value=data), args=data)
+    res = main(req)
+    for result in res["results"]:
+        assert "error" not in result
+        if result.get("num_processed", 0) > 0:
+            assert result["num_processed"] == result["output_rows"]